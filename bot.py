@@ -1,7 +1,15 @@
 import logging
 import re
 import asyncio
-from collections import namedtuple
+import bisect
+import functools
+import heapq
+import itertools
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.ext import (
     Application,
@@ -17,8 +25,6 @@ from telegram.constants import ChatAction, ParseMode
 from telegram.error import BadRequest
 import telegram.error
 import os
-import textwrap
-import whisper
 import torch
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
@@ -53,13 +59,16 @@ import search_client
 import xml_parser
 from localization import Translator
 from utils import _filter_duplicate_chunks, detect_language, strip_think, translate_string
+import entity_detector
 import entity_lookup
 import chart_generator
 import json
 import os
 from datetime import datetime
+from types import MappingProxyType
 import hashlib
-import tempfile
+import subprocess
+import numpy as np
 from urllib.parse import unquote
 
 # ---------------------------------------------------------------------------#
@@ -77,34 +86,149 @@ ACTION_SET_LANGUAGE = "ACTION_SET_LANGUAGE"
 # ---------------------------------------------------------------------------#
 #                         State and Request Queue                            #
 # ---------------------------------------------------------------------------#
-user_message_buffers: dict[int, list[str]] = {}
-user_job_trackers: dict[int, "Job"] = {}
+user_message_buffers: dict[int, deque[str]] = {}
+user_chat_contexts: dict[int, ContextTypes.DEFAULT_TYPE] = {}
 user_last_update: dict[int, Update] = {}
+user_last_activity: dict[int, float] = {}
+
+# Debounce window for buffered messages; one global job flushes every chat,
+# instead of scheduling (and rescheduling) a Job per incoming message
+BUFFER_DEBOUNCE_SECONDS = 0.8
+BUFFER_FLUSH_INTERVAL = 0.5
+
+# Hard cap for a combined buffered query
+_MAX_MESSAGE_LENGTH = 12000
+
+# Queue priority per mode (lower = served first); read-only so the flush
+# job doesn't rebuild the dict on every tick
+_PRIORITIES = MappingProxyType({
+    "fast_reply": 1,  # Highest priority for fast answers
+    "web": 2,
+    "deepseek_r1": 3,
+    "deep_search": 4,
+    "deep_research": 5,  # Lowest priority for the most intensive task
+})
+_DEFAULT_PRIORITY = 3
+
+@dataclass(slots=True, frozen=True)
+class Request:
+    update: Update
+    context: ContextTypes.DEFAULT_TYPE
+    chat_id: int
+    query: str
+
+class FastPriorityQueue:
+    """Minimal async priority queue with an O(1) put->getter handoff.
+
+    asyncio.PriorityQueue wakes a parked getter through chained futures and a
+    re-entrant get_nowait; at the queue depth this bot usually runs (0-2) that
+    machinery dominates the cost of a put/get pair. Here, when a getter is
+    already parked, put_nowait resolves its future with the item directly and
+    the heap is never touched.
+    """
 
-Request = namedtuple("Request", ["update", "context", "chat_id", "query"])
+    def __init__(self):
+        self._heap: list = []
+        self._getters: deque = deque()
+        # FIFO tiebreaker: with equal priorities heapq would otherwise
+        # compare the Request objects themselves, which are not orderable
+        self._counter = itertools.count()
+
+    def qsize(self) -> int:
+        return len(self._heap)
+
+    def empty(self) -> bool:
+        return not self._heap
+
+    async def put(self, item) -> None:
+        self.put_nowait(item)
+
+    def put_nowait(self, item) -> None:
+        while self._getters:
+            getter = self._getters.popleft()
+            if not getter.done():
+                getter.set_result(item)
+                return
+        heapq.heappush(self._heap, (item[0], next(self._counter), item))
+
+    def get_nowait(self):
+        if not self._heap:
+            raise asyncio.QueueEmpty
+        return heapq.heappop(self._heap)[2]
+
+    async def get(self):
+        if self._heap:
+            return heapq.heappop(self._heap)[2]
+        getter = asyncio.get_running_loop().create_future()
+        self._getters.append(getter)
+        try:
+            return await getter
+        except asyncio.CancelledError:
+            # If the item was already handed off, re-dispatch it instead of losing it
+            if getter.done() and not getter.cancelled():
+                self.put_nowait(getter.result())
+            raise
+
+    def task_done(self) -> None:
+        # Kept for interface parity with asyncio.Queue; nothing joins this queue
+        pass
 
 # ---------------------------------------------------------------------------#
 # Markdown V2 Escaping (final)
 # ---------------------------------------------------------------------------#
 
-_SPECIAL       = re.compile(r'([\\_\[\]\(\)~>#+\-=|{}\.!])')          # что экранируем всегда
+_ESCAPE_TABLE  = str.maketrans({c: '\\' + c for c in r'\_[]()~>#+-=|{}.!'})  # что экранируем всегда
 _SINGLE_STAR   = re.compile(r'(?<!\*)\*(?!\*)')                        # одиночная *
 _LIST_MARKER   = re.compile(r'^( *)([-+*])(\s+)', re.MULTILINE)        # "- ", "+ ", "* "
 _QUOTE_MARKER  = re.compile(r'^( *)(>+)(\s+)',   re.MULTILINE)        # "> ", ">> ", …
 _NUMERIC_MARK  = re.compile(r'^( *\d+)(\.)(\s+)', re.MULTILINE)        # "1. "
-_CODE_SPLIT    = re.compile(r'(```.*?```|`[^`]*`)', re.S)              # тройной/инлайн код
+# символы, при отсутствии которых экранирование — no-op (fast-path)
+_NEEDS_ESCAPE  = re.compile(r'[\\_\[\]()~>#+\-=|{}.!*`\n]')
+# спецсимволы MarkdownV2: если их нет, текст можно слать как есть
+_MD_SPECIAL    = re.compile(r'[_*\[\]()~`>#+\-=|{}.!\\]')
+# единый сканер: код и строки-источники "1. https://..." одним проходом
+_TOKEN_RE      = re.compile(r'(?P<code>```.*?```|`[^`]*`)|^\s*\d+\.\s+(?P<url>https?://\S+)\s*$', re.S | re.M)
 _HEADING_LINE  = re.compile(r'^(?:\s*#+\s*)+(?P<txt>\S[^\n]*)\s*$', re.MULTILINE)
 _URL_IN_PARENS = re.compile(r'\((https?://[^)\s]+)\)')
 _LINK_RE    = re.compile(r'(\[[^\]]+\])\((https?://[^)\s]+)\)')  # [text](url)
 _UNINDENT = re.compile(r'(?m)^(?![ \t]*(?:[-+*]|\d+\.|>))\s{2,}(?=\S)')
 _UNINDENT_MARKERS = re.compile(r'(?m)^[ \t]+(?=(?:[-+*]\s|\d+\\\.\s|>))')
 
-# жирный: **…** и *…* (не захватываем "* " маркер списка)
+# жирный: сначала **…**, затем *…* по результату первого прохода — второй
+# проход и обрабатывает вложенный ***жирный курсив*** (не захватываем "* ")
 _DBL_BOLD      = re.compile(r'(?<!\\)\*\*([^*\n]+?)\*\*')
 _BOLD_PAIR     = re.compile(r'(?<!\\)\*(?!\s)([^*\n]+?)\*')
 
-# строки "1. https://..." (источники)
-_SOURCES_LINE  = re.compile(r'^\s*(\d+)\.\s+(https?://\S+)\s*$', re.M)
+# ---- send_long_message: компилируем один раз, а не на каждый вызов ----
+_DBL_STAR_RE  = re.compile(r'(?<!\\)\*\*')   # неэкранированные **
+_TRIPLE_RE    = re.compile(r'(?<!\\)```')    # неэкранированные ```
+_BACKTICK_RE  = re.compile(r'(?<!\\)`')      # неэкранированные `
+_CODE_SPLIT   = re.compile(r'(```.*?```|`[^`]*`)', re.S)
+_RE_HASH      = re.compile(r'(?<!\\)#')
+_RE_DOT       = re.compile(r'(?<!\\)\.')
+_RE_LPAREN    = re.compile(r'(?<!\\)\(')
+_RE_RPAREN    = re.compile(r'(?<!\\)\)')
+_RE_HYPHEN    = re.compile(r'(?<!\\)-')
+_RE_LIST_DASH = re.compile(r'^( *)(-)(\s+)', re.M)  # списочные маркеры "- "
+
+# <think>…</think> блоки в ответах LLM
+_THINK_RE = re.compile(r'<think>.*?</think>', re.S | re.I)
+
+# эмодзи (вырезаем из тегов для MD-файлов)
+_EMOJI_RE = re.compile(
+    "["
+    "\U0001F600-\U0001F64F"  # emoticons
+    "\U0001F300-\U0001F5FF"  # symbols & pictographs
+    "\U0001F680-\U0001F6FF"  # transport & map symbols
+    "\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs (includes brain emoji)
+    "\U0001F1E0-\U0001F1FF"  # flags (iOS)
+    "☀-⛿"          # miscellaneous symbols
+    "✀-➿"          # dingbats
+    "️"                # variation selector
+    "‍"                # zero width joiner
+    "]+",
+    flags=re.UNICODE,
+)
 
 # плейсхолдеры
 PH_MINUS = '\uFFF1'; PH_PLUS = '\uFFF2'; PH_STAR = '\uFFF3'; PH_QUOTE = '\uFFF4'; PH_DOT = '\uFFF5'
@@ -116,13 +240,31 @@ def normalize(text: str) -> str:
     return (text.replace('\u00A0',' ').replace('\u202F',' ').replace('\u2009',' ')
                 .replace('\u2011','-'))
 
+def _collapse_newlines(text: str) -> str:
+    """Схлопывает прогоны из 3+ переносов до пустой строки за один проход."""
+    out = []
+    run = 0
+    for ch in text:
+        if ch == '\n':
+            run += 1
+            if run > 2:
+                continue
+        else:
+            run = 0
+        out.append(ch)
+    return ''.join(out)
+
 def _headings_to_bold(seg: str) -> str:
-    seg = _HEADING_LINE.sub(lambda m: f"*{m.group('txt')}*\n\n", seg)
-    # не даём накапливаться лишним переносам
-    return re.sub(r'\n{3,}', '\n\n', seg)
+    return _HEADING_LINE.sub(lambda m: f"*{m.group('txt')}*\n\n", seg)
 
 _BULLET_PH = {'-': PH_MINUS, '+': PH_PLUS, '*': PH_STAR}
 
+# обратные таблицы: плейсхолдеры -> исходные символы (один проход translate)
+_RESTORE_MARKERS = str.maketrans({PH_MINUS: '-', PH_PLUS: '+', PH_STAR: '*',
+                                  PH_QUOTE: '>', PH_DOT: '\\.'})
+_RESTORE_FINAL   = str.maketrans({PH_BOPEN: '*', PH_BCLOSE: '*',
+                                  PH_LB: '[', PH_RB: ']', PH_LP: '(', PH_RP: ')'})
+
 def _hide_markers(seg: str) -> str:
     def repl_list(m):
         return f"{m.group(1)}{_BULLET_PH[m.group(2)]}{m.group(3)}"
@@ -133,63 +275,74 @@ def _hide_markers(seg: str) -> str:
 
 def _restore_markers(seg: str) -> str:
     # точку в нумсписке возвращаем экранированной (1\. )
-    return (seg.replace(PH_MINUS,'-').replace(PH_PLUS,'+').replace(PH_STAR,'*')
-              .replace(PH_QUOTE,'>').replace(PH_DOT,'\\.'))
+    return seg.translate(_RESTORE_MARKERS)
 
-def escape_markdown_v2(text: str) -> str:
-    if not text:
-        return text
-    text = strip_think(normalize(text))
-    parts = _CODE_SPLIT.split(text)  # [non-code, code, non-code, ...]
-    for i in range(0, len(parts), 2):
-        seg = parts[i]
+def _escape_segment(seg: str) -> str:
+    """Применяет цепочку MarkdownV2-преобразований к одному не-кодовому сегменту."""
+    seg = _headings_to_bold(seg)  # # Заголовки -> *жирный*
+    # не даём накапливаться лишним переносам (единственный проход на сегмент)
+    seg = _collapse_newlines(seg)
 
-        # источники "1. https://..." -> читаемая ссылка
-        def _src_repl(m):
-            n, url = m.group(1), m.group(2)
-            link_target = url.replace(')', r'\)').replace('(', r'\(')
-            link_text = unquote(url)
-            return f"{PH_LB}{link_text}{PH_RB}{PH_LP}{link_target}{PH_RP}"
-        seg = _SOURCES_LINE.sub(_src_repl, seg)
+    # прячем жирный
+    seg = _DBL_BOLD.sub(lambda m: f"{PH_BOPEN}{m.group(1)}{PH_BCLOSE}", seg)
+    seg = _BOLD_PAIR.sub(lambda m: f"{PH_BOPEN}{m.group(1)}{PH_BCLOSE}", seg)
 
-        seg = _headings_to_bold(seg)  # # Заголовки -> *жирный*
+    # прячем маркеры, экранируем спецсимволы, возвращаем маркеры
+    seg = _hide_markers(seg)
+    seg = seg.translate(_ESCAPE_TABLE)
+    seg = _SINGLE_STAR.sub(r'\\*', seg)
+    seg = _restore_markers(seg)
 
-        # прячем жирный
-        seg = _DBL_BOLD.sub(lambda m: f"{PH_BOPEN}{m.group(1)}{PH_BCLOSE}", seg)
-        seg = _BOLD_PAIR.sub(lambda m: f"{PH_BOPEN}{m.group(1)}{PH_BCLOSE}", seg)
+    # убрать ведущие пробелы перед маркерами списков/нумерации/цитат
+    seg = _UNINDENT_MARKERS.sub('', seg)
 
-        # прячем маркеры, экранируем спецсимволы, возвращаем маркеры
-        seg = _hide_markers(seg)
-        seg = _SPECIAL.sub(r'\\\1', seg)
-        seg = _SINGLE_STAR.sub(r'\\*', seg)
-        seg = _restore_markers(seg)
-        
-        # убрать ведущие пробелы перед маркерами списков/нумерации/цитат
-        seg = _UNINDENT_MARKERS.sub('', seg)
+    # ← вот это новенькое: убираем лишние отступы в начале строк, кроме настоящих маркеров
+    seg = _UNINDENT.sub('', seg)
 
-        # ← вот это новенькое: убираем лишние отступы в начале строк, кроме настоящих маркеров
-        seg = _UNINDENT.sub('', seg)
+    # возвращаем жирный и синтаксис ссылок
+    seg = seg.translate(_RESTORE_FINAL)
 
-        # возвращаем жирный и синтаксис ссылок
-        seg = seg.replace(PH_BOPEN, '*').replace(PH_BCLOSE, '*')
-        seg = (seg.replace(PH_LB,'[').replace(PH_RB,']')
-                  .replace(PH_LP,'(').replace(PH_RP,')'))
-        
-        # гарантируем пустую строку ПЕРЕД строками-заголовками вида *...*\n\n
-        # (если 0 или 1 перенос — делаем два; если уже два, не трогаем)
-        seg = re.sub(r'(?<!\n)\n?(\*[^*\n]+\*\n\n)', r'\n\n\1', seg)
-        # не даём накапливаться лишним переносам
-        seg = re.sub(r'\n{3,}', '\n\n', seg)
+    # гарантируем пустую строку ПЕРЕД строками-заголовками вида *...*\n\n
+    # (если 0 или 1 перенос — делаем два; если уже два, не трогаем)
+    seg = re.sub(r'(?<!\n)\n?(\*[^*\n]+\*\n\n)', r'\n\n\1', seg)
 
-        # снять экранирование внутри URL
-        seg = _URL_IN_PARENS.sub(lambda m: f"({m.group(1).replace(r'', '')})", seg)
+    # если маркеры цитаты/нумерации встретились не в начале строки — перенос
+    seg = re.sub(r'(?<!^)(?<![\n\r])((?:\d+\\\.|>))(?=\s)', r'\n\1', seg)
 
-        # если маркеры цитаты/нумерации встретились не в начале строки — перенос
-        seg = re.sub(r'(?<!^)(?<![\n\r])((?:\d+\\\.|>))(?=\s)', r'\n\1', seg)
+    return seg
 
-        parts[i] = seg
+@functools.lru_cache(maxsize=128)
+def escape_markdown_v2(text: str) -> str:
+    if not text:
+        return text
+    text = strip_think(normalize(text))
+
+    # короткие ответы без спецсимволов не гоняем через весь конвейер
+    if _NEEDS_ESCAPE.search(text) is None:
+        return text
 
-    return ''.join(parts)
+    # один проход сканера: код оставляем как есть, строки-источники меняем на
+    # плейсхолдер-ссылки прямо внутри текущего текстового сегмента
+    out: list[str] = []
+    buf: list[str] = []
+    pos = 0
+    for m in _TOKEN_RE.finditer(text):
+        buf.append(text[pos:m.start()])
+        pos = m.end()
+        code = m.group('code')
+        if code is not None:
+            out.append(_escape_segment(''.join(buf)))
+            buf.clear()
+            out.append(code)
+        else:
+            # источник "1. https://..." -> читаемая ссылка
+            url = m.group('url')
+            link_target = url.replace(')', r'\)').replace('(', r'\(')
+            buf.append(f"{PH_LB}{unquote(url)}{PH_RB}{PH_LP}{link_target}{PH_RP}")
+    buf.append(text[pos:])
+    out.append(_escape_segment(''.join(buf)))
+
+    return ''.join(out)
 # ---------------------------------------------------------------------------#
 #                           Keyboard Generators                              #
 # ---------------------------------------------------------------------------#
@@ -206,8 +359,11 @@ def get_mode_keyboard(context: ContextTypes.DEFAULT_TYPE, chat_id: int, lang: st
         ]
     )
 
-def get_full_mode_keyboard(context: ContextTypes.DEFAULT_TYPE, lang: str) -> InlineKeyboardMarkup:
-    translator = context.application.bot_data['translator']
+# "Full mode" и "all languages" клавиатуры — чистые функции языка; строим один раз
+_full_mode_keyboards: dict[str, InlineKeyboardMarkup] = {}
+_all_languages_keyboard: InlineKeyboardMarkup | None = None
+
+def _build_full_mode_keyboard(translator, lang: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(
         [
             [
@@ -221,6 +377,27 @@ def get_full_mode_keyboard(context: ContextTypes.DEFAULT_TYPE, lang: str) -> Inl
         ]
     )
 
+def _build_all_languages_keyboard(translator) -> InlineKeyboardMarkup:
+    keyboard = [
+        [InlineKeyboardButton(lang.upper(), callback_data=f"{ACTION_SET_LANGUAGE}_{lang}")]
+        for lang in translator.supported_languages
+    ]
+    return InlineKeyboardMarkup(keyboard)
+
+def _freeze_static_keyboards(translator) -> None:
+    """Prebuilds the per-language static keyboards at startup."""
+    global _all_languages_keyboard
+    for lang in translator.supported_languages:
+        _full_mode_keyboards[lang] = _build_full_mode_keyboard(translator, lang)
+    _all_languages_keyboard = _build_all_languages_keyboard(translator)
+
+def get_full_mode_keyboard(context: ContextTypes.DEFAULT_TYPE, lang: str) -> InlineKeyboardMarkup:
+    keyboard = _full_mode_keyboards.get(lang)
+    if keyboard is None:
+        translator = context.application.bot_data['translator']
+        keyboard = _full_mode_keyboards[lang] = _build_full_mode_keyboard(translator, lang)
+    return keyboard
+
 def get_language_keyboard(context: ContextTypes.DEFAULT_TYPE, lang: str) -> InlineKeyboardMarkup:
     translator = context.application.bot_data['translator']
     return InlineKeyboardMarkup(
@@ -233,12 +410,11 @@ def get_language_keyboard(context: ContextTypes.DEFAULT_TYPE, lang: str) -> Inli
     )
 
 def get_all_languages_keyboard(context: ContextTypes.DEFAULT_TYPE) -> InlineKeyboardMarkup:
-    translator = context.application.bot_data['translator']
-    keyboard = [
-        [InlineKeyboardButton(lang.upper(), callback_data=f"{ACTION_SET_LANGUAGE}_{lang}")]
-        for lang in translator.supported_languages
-    ]
-    return InlineKeyboardMarkup(keyboard)
+    global _all_languages_keyboard
+    if _all_languages_keyboard is None:
+        translator = context.application.bot_data['translator']
+        _all_languages_keyboard = _build_all_languages_keyboard(translator)
+    return _all_languages_keyboard
 
 # ---------------------------------------------------------------------------#
 #                               Commands                                     #
@@ -306,35 +482,30 @@ async def button(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 # ---------------------------------------------------------------------------#
 #                         Request Handlers                                   #
 # ---------------------------------------------------------------------------#
-async def send_typing_periodically(bot, chat_id):
+async def send_typing_periodically(bot, chat_id, done: asyncio.Event):
+    """Sends TYPING immediately, then only re-sends if the handler is still running.
+
+    Telegram keeps the typing indicator alive for ~5 s, so short requests need a
+    single send; `done` is set by the worker when the handler finishes.
+    """
     try:
-        while True:
+        while not done.is_set():
             try:
                 await bot.send_chat_action(chat_id, ChatAction.TYPING)
-                await asyncio.sleep(8)  # Send typing action every 8 seconds
+                delay = 6
             except (telegram.error.TimedOut, telegram.error.NetworkError) as e:
                 logger.warning(f"Failed to send typing action due to network error: {e}")
-                await asyncio.sleep(15) # Wait longer before retrying
+                delay = 15 # Wait longer before retrying
+            try:
+                await asyncio.wait_for(done.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                continue  # handler still running — refresh the indicator
     except asyncio.CancelledError:
         pass # Task was cancelled, expected behavior
 
 def _remove_emojis(text: str) -> str:
     """Removes emoji characters from a string."""
-    emoji_pattern = re.compile(
-        "["
-        "\U0001F600-\U0001F64F"  # emoticons
-        "\U0001F300-\U0001F5FF"  # symbols & pictographs
-        "\U0001F680-\U0001F6FF"  # transport & map symbols
-        "\U0001F900-\U0001F9FF"  # Supplemental Symbols and Pictographs (includes brain emoji)
-        "\U0001F1E0-\U0001F1FF"  # flags (iOS)
-        "\u2600-\u26FF"          # miscellaneous symbols
-        "\u2700-\u27BF"          # dingbats
-        "\uFE0F"                # variation selector
-        "\u200d"                # zero width joiner
-        "]+",
-        flags=re.UNICODE,
-    )
-    return emoji_pattern.sub(r'', text).strip()
+    return _EMOJI_RE.sub(r'', text).strip()
 
 def _clean_text_for_plain_send(text: str) -> str:
     # Rule 1: Remove all backslashes and all asterisks, except for newlines.
@@ -350,29 +521,40 @@ def _clean_text_for_plain_send(text: str) -> str:
     cleaned_text = '\n'.join(filtered_lines)
 
     # Rule 4: Check for empty lines, no more than 2 empty lines (\n\n)
-    cleaned_text = re.sub(r'\n{3,}', '\n\n', cleaned_text)
+    cleaned_text = _collapse_newlines(cleaned_text)
 
     return cleaned_text
 
 
+@functools.lru_cache(maxsize=32)
+def _sources_separator(translator, lang: str) -> str:
+    """Returns the '## Sources:' separator for a language, built once per (translator, lang)."""
+    return f"\n\n## {translator.get_string('sources_label', lang)}:\n"
+
+
+def _write_md_sync(md_dir: str, file_path: str, content: str) -> None:
+    """Blocking directory creation + file write, meant to run off the event loop."""
+    os.makedirs(md_dir, exist_ok=True)
+    with open(file_path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+
 async def write_pelican_md_file(query: str, llm_response: str, lang: str, mode: str, translator, stats_data: dict = None, chart_path: str = None, chart_title: str = None):
     md_dir = config.MD_OUTPUT_DIR # User specified path
-    os.makedirs(md_dir, exist_ok=True)
 
     # 1. Strip <think> tags from the response
-    llm_response = re.sub(r'<think>.*?</think>', '', llm_response, flags=re.S | re.I).strip()
+    llm_response = _THINK_RE.sub('', llm_response).strip()
 
     # Separate main content from sources
     sources_text = ""
     main_content = llm_response
     try:
-        sources_label = translator.get_string('sources_label', lang)
-        sources_separator = f"\n\n## {sources_label}:\n"
-        if sources_separator in main_content:
-            # Split content and sources
-            content_parts = main_content.split(sources_separator, 1)
-            main_content = content_parts[0]
-            sources_text = f"\n\n## {sources_label}:\n{content_parts[1]}"
+        sources_separator = _sources_separator(translator, lang)
+        sep_idx = main_content.find(sources_separator)
+        if sep_idx >= 0:
+            # Split content and sources in a single scan
+            sources_text = main_content[sep_idx:]
+            main_content = main_content[:sep_idx]
     except Exception:
         # If sources label not found or any other error, treat the whole response as main content
         pass
@@ -406,7 +588,7 @@ async def write_pelican_md_file(query: str, llm_response: str, lang: str, mode:
 
     # Generate a unique filename
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    query_hash = hashlib.sha256(query.encode('utf-8')).hexdigest()[:8]
+    query_hash = hashlib.blake2b(query.encode('utf-8'), digest_size=4).hexdigest()
     filename = f"{timestamp}-{query_hash}-{mode}-{lang}.md"
     file_path = os.path.join(md_dir, filename)
 
@@ -418,16 +600,16 @@ async def write_pelican_md_file(query: str, llm_response: str, lang: str, mode:
 
     # Append statistics if provided
     if stats_data:
-        stats_block = f"""## {translate_string('Research Statistics:', lang)}\n
-"""
+        stats_lines = [f"## {translate_string('Research Statistics:', lang)}\n"]
         if "websites_visited" in stats_data:
-            stats_block += f"- {translate_string('Websites Visited:', lang)} {stats_data['websites_visited']}\n"
+            stats_lines.append(f"- {translate_string('Websites Visited:', lang)} {stats_data['websites_visited']}")
         if "chunks_analyzed" in stats_data:
-            stats_block += f"- {translate_string('Chunks Analyzed:', lang)} {stats_data['chunks_analyzed']:,}\n"
+            stats_lines.append(f"- {translate_string('Chunks Analyzed:', lang)} {stats_data['chunks_analyzed']:,}")
         if "total_chars_read" in stats_data:
-            stats_block += f"- {translate_string('Total Characters Read:', lang)} {stats_data['total_chars_read']:,}\n"
+            stats_lines.append(f"- {translate_string('Total Characters Read:', lang)} {stats_data['total_chars_read']:,}")
         # Format the stats block as a markdown comment that is not rendered in HTML
-        body += f"\n\n{stats_block.strip()}"
+        stats_block = "\n".join(stats_lines)
+        body += f"\n\n{stats_block}"
 
     # 3. Tags: only 1 tag - used mode (translated and cleaned)
     translated_mode = translator.get_string(f"mode_{mode}", lang)
@@ -447,8 +629,7 @@ Author_Bio: [GENERATE AUTHOR BIO]
 {body}
 '''
     try:
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(content)
+        await asyncio.to_thread(_write_md_sync, md_dir, file_path, content)
         logger.info(f"Successfully wrote Pelican MD file: {file_path}")
     except Exception as e:
         logger.error(f"Failed to write Pelican MD file {file_path}: {e}")
@@ -457,25 +638,23 @@ Author_Bio: [GENERATE AUTHOR BIO]
 async def fast_web_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, query: str):
     lang = context.chat_data.get('language', 'en')
     translator = context.application.bot_data['translator']
-    llm_semaphore = context.application.bot_data["llm_semaphore"]
+    llm_budget = context.application.bot_data["llm_budget"]
     ranker = context.application.bot_data["reranker"] # Use shared reranker
     await context.bot.send_chat_action(update.effective_chat.id, ChatAction.TYPING)
     try:
-        searcher = search_client.SearchClient(
-            config.SEARCH_BACKEND, config.YANDEX_API_KEY
-        )
+        searcher = context.application.bot_data["search_client"]
         xml_results = await searcher.search(query, num_results=12)
         yandex_raw = await asyncio.to_thread(xml_parser.parse_yandex_xml, xml_results)
 
         if not yandex_raw:
             # Fallback to fast reply if no snippets
-            async with llm_semaphore:
+            async with llm_budget.reserve(query):
                 final_answer = await llm_client.prompt_without_context(query, lang)
             
             # First, write the clean markdown to the file
             await write_pelican_md_file(query, final_answer, lang, "web", translator)
 
-            final_answer = re.sub(r"<think>.*?</think>", "", final_answer, flags=re.S | re.I).strip()
+            final_answer = _THINK_RE.sub('', final_answer).strip()
             telegram_text = escape_markdown_v2(final_answer)
             await send_long_message(update, telegram_text, parse_mode=ParseMode.MARKDOWN_V2)
             await show_mode_menu(context, update.effective_chat.id)
@@ -486,8 +665,7 @@ async def fast_web_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, q
             for i, c in enumerate(yandex_raw)
         ]
 
-        top_chunks = await asyncio.to_thread(
-            ranker.rerank, # Use shared ranker
+        top_chunks = await ranker.rerank( # Use shared batching ranker
             query,
             yandex_chunks,
             top_n=config.TOP_N,
@@ -496,12 +674,12 @@ async def fast_web_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, q
 
         if not top_chunks:
             # Fallback to fast reply if no snippets
-            async with llm_semaphore:
+            async with llm_budget.reserve(query):
                 final_answer = await llm_client.prompt_without_context(query, lang)
             
             await write_pelican_md_file(query, final_answer, lang, "web", translator)
 
-            final_answer = re.sub(r"<think>.*?</think>", "", final_answer, flags=re.S | re.I).strip()
+            final_answer = _THINK_RE.sub('', final_answer).strip()
             telegram_text = escape_markdown_v2(final_answer)
             await send_long_message(update, telegram_text, parse_mode=ParseMode.MARKDOWN_V2)
             await show_mode_menu(context, update.effective_chat.id)
@@ -510,17 +688,23 @@ async def fast_web_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, q
         entities_info = await entity_lookup.get_entity_info(query, lang)
         logger.info(f"Discovered entities: {entities_info}")
 
-        async with llm_semaphore:
+        async with llm_budget.reserve(query, *(chunk.text for chunk in top_chunks)):
             final_answer = await llm_client.generate_answer_from_serp(query, top_chunks, lang, translator, entities_info)
 
+        # One pass over the chunks collects count and chars together
+        chunks_analyzed = 0
+        total_chars_read = 0
+        for chunk in top_chunks:
+            chunks_analyzed += 1
+            total_chars_read += len(chunk.text)
         stats_data = {
-            "websites_visited": len(set(c.url for c in yandex_raw)),
-            "chunks_analyzed": len(top_chunks),
-            "total_chars_read": sum(len(chunk.text) for chunk in top_chunks)
+            "websites_visited": len({c.url for c in yandex_raw}),
+            "chunks_analyzed": chunks_analyzed,
+            "total_chars_read": total_chars_read
         }
         await write_pelican_md_file(query, final_answer, lang, "web", translator, stats_data)
 
-        final_answer = re.sub(r"<think>.*?</think>", "", final_answer, flags=re.S | re.I).strip()
+        final_answer = _THINK_RE.sub('', final_answer).strip()
         telegram_text = escape_markdown_v2(final_answer)
         await send_long_message(update, telegram_text, parse_mode=ParseMode.MARKDOWN_V2)
         await show_mode_menu(context, update.effective_chat.id)
@@ -533,20 +717,18 @@ async def fast_web_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, q
 async def deep_search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, query: str):
     lang = context.chat_data.get('language', 'en')
     translator = context.application.bot_data['translator']
-    llm_semaphore = context.application.bot_data["llm_semaphore"]
+    llm_budget = context.application.bot_data["llm_budget"]
     ranker = context.application.bot_data["reranker"] # Use shared reranker
 
     await update.message.reply_text(translator.get_string("deep_search_start_message", lang))
     context.chat_data['mode'] = 'fast_reply'
     await context.bot.send_chat_action(update.effective_chat.id, ChatAction.TYPING)
     try:
-        async with llm_semaphore:
+        async with llm_budget.reserve(query):
             entities_info = await entity_lookup.get_entity_info(query, lang)
             logger.info(f"Discovered entities for deep search: {entities_info}")
             sub_queries = await llm_client.get_sub_queries(query, lang)
-        searcher = search_client.SearchClient(
-            config.SEARCH_BACKEND, config.YANDEX_API_KEY
-        )
+        searcher = context.application.bot_data["search_client"]
 
         all_reranked_chunks_by_query = []
         all_processed_urls = set()
@@ -571,8 +753,7 @@ async def deep_search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
 
             all_chunks_for_sub_query = yandex_chunks + web_page_chunks
 
-            top_chunks_for_sub_query = await asyncio.to_thread(
-                ranker.rerank, # Use shared ranker
+            top_chunks_for_sub_query = await ranker.rerank( # Use shared batching ranker
                 sub_query, # Rerank against the specific sub-query
                 all_chunks_for_sub_query,
                 top_n=config.TOP_N, # Keep a good number of chunks per sub-query
@@ -590,7 +771,7 @@ async def deep_search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
             await update.message.reply_text(
                 translator.get_string("error_no_context", lang) + " " + translator.get_string("trying_fast_reply", lang)
             )
-            async with llm_semaphore:
+            async with llm_budget.reserve(query):
                 final_answer = await llm_client.prompt_without_context(
                     query,
                     lang,
@@ -600,26 +781,19 @@ async def deep_search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
             top_sources = []
         else:
             await context.bot.send_chat_action(update.effective_chat.id, ChatAction.TYPING)
-            async with llm_semaphore:
+            async with llm_budget.reserve(query, *(chunk.text for result in all_reranked_chunks_by_query for chunk in result['snippets'])):
                 final_answer = await llm_client.synthesize_answer(query, all_reranked_chunks_by_query, lang, entities_info)
 
             # Get top 5 unique source URLs from all reranked chunks
-            top_sources = []
-            seen_urls = set()
-            for result in all_reranked_chunks_by_query:
-                for chunk in result['snippets']:
-                    if chunk.source_url not in seen_urls:
-                        top_sources.append(chunk.source_url)
-                        seen_urls.add(chunk.source_url)
-                        if len(top_sources) >= 5:
-                            break
-                if len(top_sources) >= 5:
-                    break
+            urls_iter = (chunk.source_url
+                         for result in all_reranked_chunks_by_query
+                         for chunk in result['snippets'])
+            top_sources = list(itertools.islice(dict.fromkeys(urls_iter), 5))
         
         # Append sources if available
         if top_sources:
             sources_label = translator.get_string("sources_label", lang)
-            sources_text = "\n".join([f"{i+1}. {unquote(url)}" for i, url in enumerate(top_sources)])
+            sources_text = "\n".join(f"{i}. {unquote(url)}" for i, url in enumerate(top_sources, start=1))
             final_answer += f"\n\n{sources_label}:\n{sources_text}"
 
         # --- Chart Generation ---
@@ -633,25 +807,31 @@ async def deep_search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         except Exception as e:
             logger.error(f"Chart generation failed: {e}", exc_info=True)
 
-        final_answer = re.sub(r"<think>.*?</think>", "", final_answer, flags=re.S).strip()
+        final_answer = _THINK_RE.sub('', final_answer).strip()
 
-        # Collect stats for MD file
+        # Collect stats for MD file (one pass over the reranked chunks)
+        chunks_analyzed = 0
+        total_chars_read = 0
+        for result in all_reranked_chunks_by_query:
+            for chunk in result['snippets']:
+                chunks_analyzed += 1
+                total_chars_read += len(chunk.text)
         stats_data = {
             "websites_visited": len(all_processed_urls),
-            "chunks_analyzed": sum(len(result['snippets']) for result in all_reranked_chunks_by_query),
-            "total_chars_read": sum(len(chunk.text) for result in all_reranked_chunks_by_query for chunk in result['snippets'])
+            "chunks_analyzed": chunks_analyzed,
+            "total_chars_read": total_chars_read
         }
 
         # First, write the clean markdown to the file
-        chart_path, chart_title = chart_info if chart_info else (None, None)
+        chart_bytes, chart_path, chart_title = chart_info if chart_info else (None, None, None)
         await write_pelican_md_file(query, final_answer, lang, "deep_search", translator, stats_data, chart_path=chart_path, chart_title=chart_title)
-        
+
         # --- Send Chart if available ---
-        if chart_path:
+        if chart_bytes:
             try:
                 await context.bot.send_photo(
                     chat_id=update.effective_chat.id,
-                    photo=open(chart_path, 'rb'),
+                    photo=chart_bytes,
                     caption=chart_title
                 )
             except Exception as e:
@@ -672,10 +852,25 @@ async def deep_search_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text(translator.get_string("error_generic", lang))
         await show_mode_menu(context, update.effective_chat.id)
 
+def _split_at_paragraphs(s: str, limit: int):
+    """Yields ~limit-char pieces of s, cutting at the nearest paragraph break."""
+    i = 0
+    n = len(s)
+    while i < n:
+        j = min(i + limit, n)
+        if j < n:
+            k = s.rfind('\n\n', i, j)
+            if k > i:
+                j = k
+        piece = s[i:j].strip()
+        if piece:
+            yield piece
+        i = j
+
 async def deep_research_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, query: str):
     lang = context.chat_data.get('language', 'en')
     translator = context.application.bot_data['translator']
-    llm_semaphore = context.application.bot_data["llm_semaphore"]
+    llm_budget = context.application.bot_data["llm_budget"]
     ranker = context.application.bot_data["reranker"] # Use shared reranker
     
     await update.message.reply_text(translator.get_string("deep_research_start_message", lang))
@@ -683,7 +878,7 @@ async def deep_research_handler(update: Update, context: ContextTypes.DEFAULT_TY
     await show_mode_menu(context, update.effective_chat.id) # Show keyboard immediately
     await context.bot.send_chat_action(update.effective_chat.id, ChatAction.TYPING)
     try:
-        async with llm_semaphore:
+        async with llm_budget.reserve(query):
             entities_info = await entity_lookup.get_entity_info(query, lang)
             logger.info(f"Discovered entities for initial query: {entities_info}")
             steps = await llm_client.get_research_steps(query, lang, entities_info)
@@ -697,68 +892,89 @@ async def deep_research_handler(update: Update, context: ContextTypes.DEFAULT_TY
         total_chunks_analyzed = 0
         total_chars_read = 0
 
-        for step in steps:
-            await context.bot.send_chat_action(
-                update.effective_chat.id, ChatAction.TYPING
-            )
-
-            async with llm_semaphore:
-                sub_queries = await llm_client.get_sub_queries(step, lang)
-            searcher = search_client.SearchClient(
-                search_backend=config.SEARCH_BACKEND,
-                api_key=config.YANDEX_API_KEY,
-            )
-
-            xml_results = []
-            for q in sub_queries:
-                xml_result = await searcher.search(q)
-                xml_results.append(xml_result)
-
-            yandex_raw_chunks = []
-            for xml in xml_results:
-                parsed_chunks = await asyncio.to_thread(
-                    xml_parser.parse_yandex_xml, xml
+        searcher = context.application.bot_data["search_client"]
+        # Shared bounds: steps are independent until the final reduce, but the
+        # search backend and the LLM endpoint still need global rate limits
+        step_semaphore = asyncio.Semaphore(config.STEP_CONCURRENCY)
+        search_semaphore = asyncio.Semaphore(config.SEARCH_CONCURRENCY)
+
+        async def _bounded_search(q: str):
+            async with search_semaphore:
+                return await searcher.search(q)
+
+        async def _run_step(step: str):
+            """Search/fetch/rerank/summarize pipeline for a single research step."""
+            async with step_semaphore:
+                async with llm_budget.reserve(step):
+                    sub_queries = await llm_client.get_sub_queries(step, lang)
+
+                # Sub-query searches are independent — run them concurrently
+                xml_results = await asyncio.gather(
+                    *(_bounded_search(q) for q in sub_queries), return_exceptions=True
                 )
-                yandex_raw_chunks.extend(parsed_chunks)
+                for q, xml in zip(sub_queries, xml_results):
+                    if isinstance(xml, BaseException):
+                        logger.warning(f"Search failed for sub-query '{q}': {xml}")
 
-            yandex_chunks = [
-                page_processor.TextChunk(text=c.text, source_url=c.url, index=i)
-                for i, c in enumerate(yandex_raw_chunks)
-            ]
-            urls = list({c.url for c in yandex_raw_chunks})
-            web_page_chunks = await page_processor.fetch_and_process_pages(urls)
-            all_chunks = yandex_chunks + web_page_chunks
+                parsed_lists = await asyncio.gather(
+                    *(asyncio.to_thread(xml_parser.parse_yandex_xml, xml)
+                      for xml in xml_results if not isinstance(xml, BaseException))
+                )
+                yandex_raw_chunks = [c for parsed in parsed_lists for c in parsed]
+
+                yandex_chunks = [
+                    page_processor.TextChunk(text=c.text, source_url=c.url, index=i)
+                    for i, c in enumerate(yandex_raw_chunks)
+                ]
+                urls = list({c.url for c in yandex_raw_chunks})
+                web_page_chunks = await page_processor.fetch_and_process_pages(urls)
+                all_chunks = yandex_chunks + web_page_chunks
+
+                top_chunks = await ranker.rerank( # Use shared batching ranker
+                    step,
+                    all_chunks,
+                    top_n=config.TOP_N,
+                    threshold=config.RERANK_THRESHOLD,
+                )
 
-            # Update stats for this step
-            total_websites_visited.update(url for chunk in all_chunks for url in [chunk.source_url])
-            total_chunks_analyzed += len(all_chunks)
-            total_chars_read += sum(len(chunk.text) for chunk in all_chunks)
+                # Filter out duplicate chunks
+                unique_top_chunks = _filter_duplicate_chunks(top_chunks)
+
+                summary = None
+                if unique_top_chunks:
+                    # Discover entities for the current research step
+                    entities_info_step = await entity_lookup.get_entity_info(step, lang)
+                    logger.info(f"Discovered entities for step '{step}': {entities_info_step}")
+
+                    # Generate summary for the current research step
+                    async with llm_budget.reserve(step, *(chunk.text for chunk in unique_top_chunks)):
+                        summary = await llm_client.generate_summary_from_chunks(
+                            step, unique_top_chunks, lang, translator, entities_info_step
+                        )
+                return all_chunks, unique_top_chunks, summary
+
+        await context.bot.send_chat_action(update.effective_chat.id, ChatAction.TYPING)
+        step_results = await asyncio.gather(
+            *(_run_step(step) for step in steps), return_exceptions=True
+        )
 
-            top_chunks = await asyncio.to_thread(
-                ranker.rerank, # Use shared ranker
-                step,
-                all_chunks,
-                top_n=config.TOP_N,
-                threshold=config.RERANK_THRESHOLD,
-            )
+        # Merge per-step results in the original step order
+        for step, result in zip(steps, step_results):
+            if isinstance(result, BaseException):
+                logger.warning(f"Research step '{step}' failed: {result}")
+                continue
+            all_chunks, unique_top_chunks, summary = result
 
-            # Filter out duplicate chunks
-            unique_top_chunks = _filter_duplicate_chunks(top_chunks)
+            total_chunks_analyzed += len(all_chunks)
+            for chunk in all_chunks:
+                total_websites_visited.add(chunk.source_url)
+                total_chars_read += len(chunk.text)
 
             # Collect sources for the final output
             for chunk in unique_top_chunks:
                 all_top_sources.add(chunk.source_url)
 
             if unique_top_chunks:
-                # Discover entities for the current research step
-                entities_info_step = await entity_lookup.get_entity_info(step, lang)
-                logger.info(f"Discovered entities for step '{step}': {entities_info_step}")
-
-                # Generate summary for the current research step
-                async with llm_semaphore:
-                    summary = await llm_client.generate_summary_from_chunks(
-                        step, unique_top_chunks, lang, translator, entities_info_step
-                    )
                 research_data[step] = summary
 
         if not research_data:
@@ -766,27 +982,34 @@ async def deep_research_handler(update: Update, context: ContextTypes.DEFAULT_TY
             return
 
         # Join all research items and their content together
-        joined_research_items = ""
-        for step, summary in research_data.items():
-            joined_research_items += f"\n\n## {step}\n"
-            joined_research_items += summary
+        joined_research_items = "".join(
+            f"\n\n## {step}\n{summary}" for step, summary in research_data.items()
+        )
 
         # --- New Map-Reduce Workflow ---
         # 1. Split the combined research data into manageable chunks
         chunk_size = 6000
-        chunks = textwrap.wrap(joined_research_items, chunk_size, break_long_words=False, replace_whitespace=False)
+        chunks = list(_split_at_paragraphs(joined_research_items, chunk_size))
         logger.info(f"Split research data into {len(chunks)} chunks for summarization.")
 
-        # 2. Summarize each chunk sequentially to respect rate limits (Map step)
+        # 2. Summarize the chunks concurrently, gated by the shared LLM semaphore (Map step)
+        async def _summarize_one(chunk: str):
+            async with llm_budget.reserve(chunk):
+                return await llm_client.summarize_research_chunk(chunk, query, lang)
+
+        summaries = await asyncio.gather(
+            *(_summarize_one(chunk) for chunk in chunks), return_exceptions=True
+        )
         valid_summaries = []
-        for chunk in chunks:
-            summary = await llm_client.summarize_research_chunk(chunk, query, lang)
-            if summary:
+        for summary in summaries:
+            if isinstance(summary, BaseException):
+                logger.warning(f"Chunk summarization failed: {summary}")
+            elif summary:
                 valid_summaries.append(summary)
         logger.info(f"Generated {len(valid_summaries)} summaries from chunks.")
 
         # 3. Synthesize the final answer from the summaries (Reduce step)
-        async with llm_semaphore:
+        async with llm_budget.reserve(*valid_summaries, output_tokens=9000):
             final_answer = await llm_client.polish_research_answer("\n\n".join(valid_summaries), query, lang, translator)
         
         # --- Chart Generation ---
@@ -807,15 +1030,15 @@ async def deep_research_handler(update: Update, context: ContextTypes.DEFAULT_TY
             "total_chars_read": total_chars_read
         }
         # First, write the clean markdown to the file
-        chart_path, chart_title = chart_info if chart_info else (None, None)
+        chart_bytes, chart_path, chart_title = chart_info if chart_info else (None, None, None)
         await write_pelican_md_file(query, final_answer, lang, "deep_research", translator, stats_data, chart_path=chart_path, chart_title=chart_title)
-        
+
         # --- Send Chart if available ---
-        if chart_path:
+        if chart_bytes:
             try:
                 await context.bot.send_photo(
                     chat_id=update.effective_chat.id,
-                    photo=open(chart_path, 'rb'),
+                    photo=chart_bytes,
                     caption=chart_title
                 )
             except Exception as e:
@@ -836,6 +1059,53 @@ async def deep_research_handler(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text(translator.get_string("error_generic", lang))
         await show_mode_menu(context, update.effective_chat.id)
 
+# Whisper живёт в отдельном процессе: int8-инференс на CPU держит GIL-тяжёлые
+# участки, и в общем процессе они бы тормозили event loop на сотни мс
+_whisper_model = None       # заполняется только внутри процесса-воркера
+_whisper_executor = None
+
+def _init_whisper_worker():
+    """Runs inside the dedicated worker process: load the model once."""
+    global _whisper_model
+    from faster_whisper import WhisperModel
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    compute_type = "int8_float16" if device == "cuda" else "int8"
+    _whisper_model = WhisperModel("base", device=device, compute_type=compute_type)
+
+def _transcribe_in_worker(audio: np.ndarray, lang: str) -> str:
+    """Runs inside the dedicated worker process."""
+    segments, _info = _whisper_model.transcribe(
+        audio, language=lang, beam_size=3, temperature=0.0,
+        condition_on_previous_text=True, vad_filter=True,
+    )
+    return "".join(segment.text for segment in segments)
+
+def _get_whisper_executor() -> ProcessPoolExecutor:
+    """Starts the whisper worker process on first use (lazy, как и раньше)."""
+    global _whisper_executor
+    if _whisper_executor is None:
+        logger.info("Starting whisper worker process...")
+        # spawn, не fork: к первому голосовому сообщению родитель уже
+        # инициализировал CUDA (реранкер грузится на старте), а CUDA нельзя
+        # переинициализировать в fork-нутом потомке
+        _whisper_executor = ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_whisper_worker,
+        )
+    return _whisper_executor
+
+def _decode_voice(data: bytes, sr: int = 16000) -> np.ndarray:
+    """Decodes compressed voice bytes to 16 kHz mono float32 PCM via an ffmpeg pipe.
+
+    Same as whisper.load_audio, but reads from memory instead of a temp file."""
+    proc = subprocess.run(
+        ["ffmpeg", "-nostdin", "-i", "pipe:0", "-f", "s16le", "-ac", "1",
+         "-acodec", "pcm_s16le", "-ar", str(sr), "pipe:1"],
+        input=data, capture_output=True, check=True,
+    )
+    return np.frombuffer(proc.stdout, np.int16).flatten().astype(np.float32) / 32768.0
+
 async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     chat_id = update.effective_chat.id
     if 'language' not in context.chat_data:
@@ -847,14 +1117,18 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
 
     try:
         voice = update.message.voice
-        with tempfile.NamedTemporaryFile(suffix=".oga") as temp_audio_file:
-            voice_file = await voice.get_file()
-            await voice_file.download_to_drive(temp_audio_file.name)
-            
-            whisper_model = context.application.bot_data["whisper_model"]
-            lang = context.chat_data.get('language', 'en')
-            result = await asyncio.to_thread(whisper_model.transcribe, temp_audio_file.name, language=lang, beam_size=3, temperature=0.0, condition_on_previous_text=True)
-            transcribed_text = result["text"]
+        voice_file = await voice.get_file()
+        # голос остаётся в памяти — без temp-файла и обратного чтения с диска
+        audio_bytes = bytes(await voice_file.download_as_bytearray())
+
+        lang = context.chat_data.get('language', 'en')
+        audio = await asyncio.to_thread(_decode_voice, audio_bytes)
+
+        # инференс идёт в отдельном процессе и не конкурирует с event loop
+        loop = asyncio.get_running_loop()
+        transcribed_text = await loop.run_in_executor(
+            _get_whisper_executor(), _transcribe_in_worker, audio, lang
+        )
     finally:
         # Delete the hourglass message once transcription is done
         await context.bot.delete_message(chat_id, status_message.message_id)
@@ -863,29 +1137,55 @@ async def handle_voice_message(update: Update, context: ContextTypes.DEFAULT_TYP
         # Send the transcribed text back to the user
         await context.bot.send_message(chat_id, transcribed_text)
 
-        # Add message to buffer and store the latest update object
-        buffer = user_message_buffers.setdefault(chat_id, [])
+        # Add message to buffer and store the latest update object;
+        # the global flush job picks it up once the debounce window passes
+        buffer = user_message_buffers.setdefault(chat_id, deque(maxlen=config.MAX_BUFFERED_MSGS))
         buffer.append(transcribed_text)
         user_last_update[chat_id] = update
+        user_chat_contexts[chat_id] = context
+        user_last_activity[chat_id] = time.monotonic()
 
-        # If a job is already scheduled for this user, remove it
-        if chat_id in user_job_trackers:
-            user_job_trackers[chat_id].schedule_removal()
-
-        # Schedule the processing job
-        new_job = context.job_queue.run_once(
-            process_buffered_messages,
-            when=0.8,  # 0.8-second delay (adjust as needed)
-            chat_id=chat_id,
-            name=f"process-msg-{chat_id}"
-        )
-        user_job_trackers[chat_id] = new_job
-
-async def fast_reply_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, query: str):
-    lang = context.chat_data.get('language', 'en')
-    translator = context.application.bot_data['translator']
-    llm_semaphore = context.application.bot_data["llm_semaphore"]
+async def _stream_to_message(update: Update, context: ContextTypes.DEFAULT_TYPE, deltas) -> str:
+    """Accumulates streamed LLM deltas, editing a draft message every ~400 ms.
 
+    Shows plain text while tokens arrive (with any <think> prefix hidden); the
+    draft is deleted at the end so the caller can do the definitive MarkdownV2
+    render via send_long_message. Returns the full think-stripped text.
+    """
+    chat_id = update.effective_chat.id
+    message = None
+    buf: list[str] = []
+    shown = ""
+    last_edit = 0.0
+    loop = asyncio.get_running_loop()
+    async for delta in deltas:
+        buf.append(delta)
+        now = loop.time()
+        if now - last_edit < 0.4:
+            continue
+        visible = strip_think(''.join(buf))
+        # Telegram caps a single message at 4096 chars — stop editing past that
+        if not visible or visible == shown or len(visible) > 4000:
+            continue
+        try:
+            if message is None:
+                message = await update.message.reply_text(visible)
+            else:
+                await context.bot.edit_message_text(visible, chat_id=chat_id, message_id=message.message_id)
+            shown = visible
+            last_edit = now
+        except telegram.error.TelegramError as e:
+            logger.warning(f"Progressive edit failed: {e}")
+    if message is not None:
+        try:
+            await context.bot.delete_message(chat_id, message.message_id)
+        except telegram.error.TelegramError:
+            pass
+    return strip_think(''.join(buf)).strip()
+
+@functools.lru_cache(maxsize=64)
+def _mode_prompt_names(translator, lang: str):
+    """Per-language mode names for the fast-reply prompt; translations are static."""
     # Get available modes for the prompt, excluding the current mode
     mode_keys = ["web", "deep_search", "deep_research"]
     available_modes = [translator.get_string(f"mode_{key}", lang) for key in mode_keys]
@@ -896,13 +1196,30 @@ async def fast_reply_handler(update: Update, context: ContextTypes.DEFAULT_TYPE,
         "deep_search": translator.get_string("mode_deep_search", lang),
         "deep_research": translator.get_string("mode_deep_research", lang),
     }
+    return available_modes, translated_mode_names
+
+async def fast_reply_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, query: str):
+    lang = context.chat_data.get('language', 'en')
+    translator = context.application.bot_data['translator']
+    llm_budget = context.application.bot_data["llm_budget"]
+
+    available_modes, translated_mode_names = _mode_prompt_names(translator, lang)
 
     await context.bot.send_chat_action(update.effective_chat.id, ChatAction.TYPING)
     try:
-        async with llm_semaphore:
-            final_answer = await llm_client.fast_reply(query, lang, available_modes, translated_mode_names)
-        
-        final_answer = re.sub(r"<think>.*?</think>", "", final_answer, flags=re.S | re.I).strip()
+        async with llm_budget.reserve(query):
+            # Stream tokens into a progressively edited draft when the backend
+            # supports it (Together); Ollama keeps the one-shot call.
+            stream_fn = getattr(llm_client, 'fast_reply_stream', None)
+            if stream_fn is not None:
+                final_answer = await _stream_to_message(
+                    update, context,
+                    stream_fn(query, lang, available_modes, translated_mode_names),
+                )
+            else:
+                final_answer = await llm_client.fast_reply(query, lang, available_modes, translated_mode_names)
+
+        final_answer = _THINK_RE.sub('', final_answer).strip()
         
         if llm_client.contains_chinese(final_answer):
             await update.message.reply_text(translator.get_string("error_fast_reply_chinese", lang))
@@ -927,11 +1244,11 @@ async def fast_reply_handler(update: Update, context: ContextTypes.DEFAULT_TYPE,
 async def deepseek_r1_handler(update: Update, context: ContextTypes.DEFAULT_TYPE, query: str):
     lang = context.chat_data.get('language', 'en')
     translator = context.application.bot_data['translator']
-    llm_semaphore = context.application.bot_data["llm_semaphore"]
+    llm_budget = context.application.bot_data["llm_budget"]
 
     await context.bot.send_chat_action(update.effective_chat.id, ChatAction.TYPING)
     try:
-        async with llm_semaphore:
+        async with llm_budget.reserve(query):
             final_answer = await llm_client.deepseek_r1_reply(query, lang)
         
         await write_pelican_md_file(query, final_answer, lang, "deepseek_r1", translator)
@@ -948,61 +1265,146 @@ async def deepseek_r1_handler(update: Update, context: ContextTypes.DEFAULT_TYPE
         await update.message.reply_text(translator.get_string("error_generic", lang))
         await show_mode_menu(context, update.effective_chat.id)
 
+# ---------------------------------------------------------------------------#
+#                         LLM budget (cost-aware limiter)                    #
+# ---------------------------------------------------------------------------#
+class TokenBudget:
+    """Cost-aware limiter for LLM calls: rolling 60 s token window + concurrency cap.
+
+    reserve() charges an estimate of prompt+completion tokens before the call,
+    so one huge synthesis no longer costs the same slot as a short fast reply;
+    callers wait until the estimate fits under the per-minute budget.
+    """
+
+    def __init__(self, tokens_per_minute: int, max_concurrency: int):
+        self.tokens_per_minute = tokens_per_minute
+        self._window: deque = deque()  # (monotonic_ts, tokens)
+        self._used = 0
+        self._lock = asyncio.Lock()
+        self._sem = asyncio.Semaphore(max_concurrency)
+
+    def locked(self) -> bool:
+        return self._sem.locked()
+
+    def reserve(self, *texts: str, output_tokens: int = 1024) -> "_Reservation":
+        # ~3 chars per token — the same estimate the clients use for truncation
+        tokens = sum(len(t) for t in texts if t) // 3 + output_tokens
+        return _Reservation(self, min(tokens, self.tokens_per_minute))
+
+    async def _acquire(self, tokens: int):
+        await self._sem.acquire()
+        try:
+            while True:
+                async with self._lock:
+                    now = asyncio.get_event_loop().time()
+                    while self._window and self._window[0][0] <= now - 60.0:
+                        self._used -= self._window.popleft()[1]
+                    if self._used + tokens <= self.tokens_per_minute:
+                        self._window.append((now, tokens))
+                        self._used += tokens
+                        return
+                    wait = self._window[0][0] + 60.0 - now
+                logger.info(f"LLM budget exhausted; waiting {wait:.1f}s for headroom.")
+                await asyncio.sleep(max(wait, 0.1))
+        except BaseException:
+            self._sem.release()
+            raise
+
+    def _release(self):
+        self._sem.release()
+
+
+class _Reservation:
+    def __init__(self, budget: TokenBudget, tokens: int):
+        self._budget = budget
+        self._tokens = tokens
+
+    async def __aenter__(self):
+        await self._budget._acquire(self._tokens)
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._budget._release()
+
 # ---------------------------------------------------------------------------#
 #                         Core Logic (Worker)                                #
 # ---------------------------------------------------------------------------#
-async def worker(name: str, queue: asyncio.PriorityQueue, app_data: dict):
+# Mode -> handler dispatch table; built once instead of per dequeued request
+_HANDLER_MAP = {
+    "web": fast_web_handler,
+    "deep_research": deep_research_handler,
+    "deep_search": deep_search_handler,
+    "fast_reply": fast_reply_handler, # New handler for Fast Answer
+    "deepseek_r1": deepseek_r1_handler,
+}
+
+async def _process_request(name: str, translator, priority: int, request: "Request") -> None:
+    """Handles one dequeued request; failures are reported to the chat, not raised."""
+    typing_task = None
+    typing_done = None
+    update = request.update
+    context = request.context
+    try:
+        chat_id = request.chat_id
+        query = request.query
+        lang = context.chat_data.get('language', 'en')
+
+        llm_budget = context.application.bot_data["llm_budget"]
+        if llm_budget.locked():
+            await update.message.reply_text(translator.get_string("waiting_in_queue", lang))
+
+        mode = context.chat_data.get('mode', 'fast_reply')
+        logger.info(f"Worker {name} processing query for chat {chat_id} in mode {mode} with priority {priority}.")
+
+        # Start typing indicator
+        typing_done = asyncio.Event()
+        typing_task = asyncio.create_task(send_typing_periodically(context.bot, chat_id, typing_done))
+
+        handler = _HANDLER_MAP.get(mode)
+        if handler:
+            await handler(update, context, query)
+        else:
+            await update.message.reply_text("Mode not implemented yet.")
+
+    except telegram.error.TimedOut as e:
+        logger.error(f"Timeout error in worker {name}: {e}", exc_info=True)
+        lang = context.chat_data.get('language', 'en')
+        await update.message.reply_text(translator.get_string("error_timeout", lang))
+    except Exception as e:
+        logger.error(f"Error in worker {name}: {e}", exc_info=True)
+        lang = context.chat_data.get('language', 'en')
+        await update.message.reply_text(translator.get_string("error_generic", lang))
+    finally:
+        if typing_task:
+            typing_done.set()
+            typing_task.cancel()
+            try:
+                await typing_task
+            except asyncio.CancelledError:
+                pass
+
+async def worker(name: str, queue: FastPriorityQueue, app_data: dict):
     translator = app_data['translator']
     while True:
-        typing_task = None
+        # Block for one request, then drain whatever is already queued so a
+        # burst is handled in one wakeup instead of one context switch per item
+        batch = [await queue.get()]
+        while True:
+            try:
+                batch.append(queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        # Each mode has its own priority, so sorting by priority groups the
+        # batch by mode and serves fast_reply before deep_research. Requests
+        # run one at a time: the worker pool is the concurrency cap, and a
+        # gather here would let one worker run a whole burst at once.
+        batch.sort(key=lambda item: item[0])
         try:
-            priority, request = await queue.get()
-
-            chat_id = request.chat_id
-            update = request.update
-            context = request.context
-            query = request.query
-            lang = context.chat_data.get('language', 'en')
-
-            llm_semaphore = context.application.bot_data["llm_semaphore"]
-            if llm_semaphore.locked():
-                await update.message.reply_text(translator.get_string("waiting_in_queue", lang))
-
-            mode = context.chat_data.get('mode', 'fast_reply')
-            logger.info(f"Worker {name} processing query for chat {chat_id} in mode {mode} with priority {priority}.")
-
-            # Start typing indicator
-            typing_task = asyncio.create_task(send_typing_periodically(context.bot, chat_id))
-
-            handler_map = {
-                "web": fast_web_handler,
-                "deep_research": deep_research_handler,
-                "deep_search": deep_search_handler,
-                "fast_reply": fast_reply_handler, # New handler for Fast Answer
-                "deepseek_r1": deepseek_r1_handler,
-            }
-            handler = handler_map.get(mode)
-            if handler:
-                await handler(update, context, query)
-            else:
-                await update.message.reply_text("Mode not implemented yet.")
-
-        except telegram.error.TimedOut as e:
-            logger.error(f"Timeout error in worker {name}: {e}", exc_info=True)
-            lang = context.chat_data.get('language', 'en')
-            await update.message.reply_text(translator.get_string("error_timeout", lang))
-        except Exception as e:
-            logger.error(f"Error in worker {name}: {e}", exc_info=True)
-            lang = context.chat_data.get('language', 'en')
-            await update.message.reply_text(translator.get_string("error_generic", lang))
+            for priority, request in batch:
+                await _process_request(name, translator, priority, request)
         finally:
-            if typing_task:
-                typing_task.cancel()
-                try:
-                    await typing_task
-                except asyncio.CancelledError:
-                    pass
-            queue.task_done()
+            for _ in batch:
+                queue.task_done()
 
 # ---------------------------------------------------------------------------#
 #                         Message Handling (Gatekeeper)                       #
@@ -1017,23 +1419,13 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await start(update, context)
         return
 
-    # Add message to buffer and store the latest update object
-    buffer = user_message_buffers.setdefault(chat_id, [])
+    # Add message to buffer and store the latest update object;
+    # the global flush job picks it up once the debounce window passes
+    buffer = user_message_buffers.setdefault(chat_id, deque(maxlen=config.MAX_BUFFERED_MSGS))
     buffer.append(message_text)
     user_last_update[chat_id] = update
-
-    # If a job is already scheduled for this user, remove it
-    if chat_id in user_job_trackers:
-        user_job_trackers[chat_id].schedule_removal()
-
-    # Schedule the processing job
-    new_job = context.job_queue.run_once(
-        process_buffered_messages,
-        when=0.8,  # 0.8-second delay (adjust as needed)
-        chat_id=chat_id,
-        name=f"process-msg-{chat_id}"
-    )
-    user_job_trackers[chat_id] = new_job
+    user_chat_contexts[chat_id] = context
+    user_last_activity[chat_id] = time.monotonic()
 
 # ---------------------------------------------------------------------------#
 # Safe split & send for MarkdownV2 (final)
@@ -1059,7 +1451,7 @@ async def _extract_code_to_files(update, text: str) -> str:
     Находит большие ```lang\n...\n``` блоки, шлёт их как document, 
     а в тексте оставляет плейсхолдер 'Код во вложении'.
     """
-    out, pos, idx = [], 0, 1
+    out, sends, pos, idx = [], [], 0, 1
     for m in _CODE_BLOCK_RE.finditer(text):
         lang, code = m.group(1), m.group(2)
         if len(code) < _CODE_AS_FILE_THRESHOLD:
@@ -1068,11 +1460,14 @@ async def _extract_code_to_files(update, text: str) -> str:
         ext = _guess_ext(lang)
         bio = io.BytesIO(code.encode("utf-8"))
         bio.name = f"snippet_{idx}.{ext}"
-        await update.message.reply_document(InputFile(bio))
+        sends.append(update.message.reply_document(InputFile(bio)))
         out.append("👆📄📎\n")              # безопасный плейсхолдер
         pos = m.end()
         idx += 1
     out.append(text[pos:])
+    if sends:
+        # вложения шлём одним gather — загрузки в Telegram идут параллельно
+        await asyncio.gather(*sends)
     return "".join(out)
 
 def restore_link_syntax(text: str) -> str:
@@ -1091,42 +1486,53 @@ async def send_long_message(update, text: str, **kwargs):
     MAX = 4096
     if text is None:
         text = ""
-    
+
+    # быстрый путь: короткий текст без спецсимволов MarkdownV2 отправляем как
+    # есть — ни извлечение кода, ни расчёт позиций маркеров ему не нужны
+    if len(text) <= MAX and _MD_SPECIAL.search(text) is None:
+        await update.message.reply_text(text, **kwargs)
+        return
+
     text = await _extract_code_to_files(update, text)
 
     # ---------- helpers: safe split ----------
-    _DBL_STAR_RE  = re.compile(r'(?<!\\)\*\*')   # неэкранированные **
-    _TRIPLE_RE    = re.compile(r'(?<!\\)```')    # неэкранированные ```
-    _BACKTICK_RE  = re.compile(r'(?<!\\)`')      # неэкранированные `
-    _CODE_SPLIT   = re.compile(r'(```.*?```|`[^`]*`)', re.S)
-    _LINK_RE    = re.compile(r'(\[[^\]]+\])\((https?://[^)\s]+)\)')  # [text](url)
-
-    def _is_safe_cut(s: str, idx: int) -> bool:
-        if idx <= 0 or idx >= len(s):
+    # позиции маркеров считаем один раз на всё сообщение; чётность на отрезке
+    # [pos, idx) получаем через bisect — чанкование становится O(N)
+    n = len(text)
+    triples   = [m.start() for m in _TRIPLE_RE.finditer(text)]
+    backticks = [m.start() for m in _BACKTICK_RE.finditer(text)]
+    dbl_stars = [m.start() for m in _DBL_STAR_RE.finditer(text)]
+
+    def _find_safe_cut(pos: int, limit: int) -> int:
+        end = min(limit, n)
+
+        def _is_safe_cut(idx: int) -> bool:
+            if idx <= pos or idx >= n:
+                return True
+            if text[idx - 1] == '\\':                          # не после обратного слэша
+                return False
+            if text[idx - 1] == '*' and text[idx] == '*':      # не между '**'
+                return False
+            if text[idx - 1] == '`' and text[idx] == '`':      # не между '``'
+                return False
+            if (bisect.bisect_right(triples, idx - 3)
+                    - bisect.bisect_left(triples, pos)) % 2 == 1:   # не внутри ``` … ```
+                return False
+            if (bisect.bisect_left(backticks, idx)
+                    - bisect.bisect_left(backticks, pos)) % 2 == 1: # не внутри ` … `
+                return False
+            if (bisect.bisect_right(dbl_stars, idx - 2)
+                    - bisect.bisect_left(dbl_stars, pos)) % 2 == 1: # не при незакрытом **
+                return False
             return True
-        if s[idx - 1] == '\\':                          # не после обратного слэша
-            return False
-        if s[idx - 1] == '*' and s[idx] == '*':         # не между '**'
-            return False
-        if s[idx - 1] == '`' and s[idx] == '`':         # не между '``'
-            return False
-        if len(_TRIPLE_RE.findall(s[:idx])) % 2 == 1:   # не внутри ``` … ```
-            return False
-        if len(_BACKTICK_RE.findall(s[:idx])) % 2 == 1: # не внутри ` … `
-            return False
-        if len(_DBL_STAR_RE.findall(s[:idx])) % 2 == 1: # не при незакрытом **
-            return False
-        return True
-
-    def _find_safe_cut(s: str, limit: int) -> int:
-        end = min(limit, len(s))
+
         # сначала ищем перевод строки или пробел
-        candidates = [s.rfind('\n', 0, end), s.rfind(' ', 0, end)]
+        candidates = [text.rfind('\n', pos, end), text.rfind(' ', pos, end)]
         cut = max([c for c in candidates if c != -1], default=end)
         probe = cut
-        while probe > 0 and not _is_safe_cut(s, probe):
+        while probe > pos and not _is_safe_cut(probe):
             probe -= 1
-        return probe if probe > 0 and _is_safe_cut(s, probe) else end
+        return probe if probe > pos and _is_safe_cut(probe) else end
 
     def _neutralize_unbalanced(chunk: str) -> str:
         # закрыть незакрытый ```/`
@@ -1144,34 +1550,31 @@ async def send_long_message(update, text: str, **kwargs):
             chunk += '\\'
         return chunk
 
-    # --- NEW: маленькие помощники для границы чанка ---
-    def _avoid_digit_split(left: str, right: str) -> tuple[str, str]:
+    # --- NEW: маленькие помощники для границы чанка (двигают только индекс) ---
+    def _avoid_digit_split(pos: int, cut: int) -> int:
         """Если слева оканчивается цифрами, а справа начинается цифрой — не резать '10'."""
-        if left and right and left[-1].isdigit() and right[0].isdigit():
-            j = len(left) - 1
-            while j >= 0 and left[j].isdigit():
+        if pos < cut < n and text[cut - 1].isdigit() and text[cut].isdigit():
+            j = cut - 1
+            while j >= pos and text[j].isdigit():
                 j -= 1
-            moved = left[j+1:]           # хвост цифр, например '10'
-            return left[:j+1], moved + right
-        return left, right
+            return j + 1                 # начало хвоста цифр, например '10'
+        return cut
 
-    def _fix_boundary_inside_link(left: str, right: str) -> tuple[str, str]:
+    def _fix_boundary_inside_link(pos: int, cut: int) -> int:
         """
         Не резать внутри [текст](url).
         Если слева есть '[' без соответствующего ']' — переносим границу к этому '['.
         Если слева есть ']' и затем незакрытая '(' — переносим границу к ']'.
         """
-        lb = left.rfind('[')
-        rb = left.rfind(']')
+        lb = text.rfind('[', pos, cut)
+        rb = text.rfind(']', pos, cut)
         if lb > rb:  # внутри текста ссылки
-            cut = lb
-            return left[:cut], left[cut:] + right
-        lp = left.rfind('(')
-        rp = left.rfind(')')
+            return lb
+        lp = text.rfind('(', pos, cut)
+        rp = text.rfind(')', pos, cut)
         if rb != -1 and rb < lp > rp:  # внутри (url)
-            cut = rb  # порежем перед '('
-            return left[:cut], left[cut:] + right
-        return left, right
+            return rb  # порежем перед '('
+        return cut
 
     # ---------- helpers: fallbacks ----------
     def _escape_hash_and_dot_outside_code(s: str) -> str:
@@ -1183,8 +1586,8 @@ async def send_long_message(update, text: str, **kwargs):
             # прячем ссылки: (url) -> PH_L url PH_R
             seg = _LINK_RE.sub(lambda m: f"{m.group(1)}{PH_L}{m.group(2)}{PH_R}", seg)
             # экранируем
-            seg = re.sub(r'(?<!\\)#', r'\#', seg)
-            seg = re.sub(r'(?<!\\)\.', r'\.', seg)
+            seg = _RE_HASH.sub(r'\#', seg)
+            seg = _RE_DOT.sub(r'\.', seg)
             # возвращаем ссылки
             seg = seg.replace(PH_L, '(').replace(PH_R, ')')
             parts[i] = seg
@@ -1199,8 +1602,8 @@ async def send_long_message(update, text: str, **kwargs):
             # прячем ссылки: (url) -> PH_L url PH_R
             seg = _LINK_RE.sub(lambda m: f"{m.group(1)}{PH_L}{m.group(2)}{PH_R}", seg)
             # экранируем обычные скобки
-            seg = re.sub(r'(?<!\\)\(', r'\(', seg)
-            seg = re.sub(r'(?<!\\)\)', r'\)', seg)
+            seg = _RE_LPAREN.sub(r'\(', seg)
+            seg = _RE_RPAREN.sub(r'\)', seg)
             # возвращаем ссылки
             seg = seg.replace(PH_L, '(').replace(PH_R, ')')
             parts[i] = seg
@@ -1215,9 +1618,9 @@ async def send_long_message(update, text: str, **kwargs):
             # прячем ссылки
             seg = _LINK_RE.sub(lambda m: f"{m.group(1)}{PH_L}{m.group(2)}{PH_R}", seg)
             # списочные маркеры "- " -> "\- "
-            seg = re.sub(r'^( *)(-)(\s+)', lambda m: f"{m.group(1)}\\-{m.group(3)}", seg, flags=re.M)
+            seg = _RE_LIST_DASH.sub(lambda m: f"{m.group(1)}\\-{m.group(3)}", seg)
             # остальные дефисы
-            seg = re.sub(r'(?<!\\)-', r'\-', seg)
+            seg = _RE_HYPHEN.sub(r'\-', seg)
             # возвращаем ссылки
             seg = seg.replace(PH_L, '(').replace(PH_R, ')')
             parts[i] = seg
@@ -1243,29 +1646,31 @@ async def send_long_message(update, text: str, **kwargs):
                     await update.message.reply_text(cleaned_final_text, parse_mode=None, **plain_kwargs)
         return
 
-    rest = text
     # клавиатуру/inline-кнопки показываем только в последнем сообщении
     common_kwargs = {k: v for k, v in kwargs.items() if k != 'reply_markup'}
     last_kwargs   = kwargs
 
-    while rest:
-        if len(rest) <= MAX:
-            chunk, rest = rest, ""
+    # курсор по исходной строке вместо rest = rest[cut:] — без перескана хвоста
+    pos = 0
+    while pos < n:
+        if n - pos <= MAX:
+            chunk, pos = text[pos:], n
         else:
-            cut = _find_safe_cut(rest, MAX)
-            if cut <= 0:
-                cut = MAX  # страховка
-            chunk, rest = rest[:cut], rest[cut:]
+            cut = _find_safe_cut(pos, pos + MAX)
+            if cut <= pos:
+                cut = pos + MAX  # страховка
 
             # --- NEW: не резать между цифрами (например, '10\. ')
-            chunk, rest = _avoid_digit_split(chunk, rest)
+            cut = _avoid_digit_split(pos, cut)
             # --- NEW: не резать внутри [текст](url)
-            chunk, rest = _fix_boundary_inside_link(chunk, rest)
+            cut = _fix_boundary_inside_link(pos, cut)
+
+            chunk, pos = text[pos:cut], cut
 
         chunk = _neutralize_unbalanced(chunk)
 
         try:
-            if rest:
+            if pos < n:
                 await update.message.reply_text(chunk, **common_kwargs)
             else:
                 await update.message.reply_text(chunk, **last_kwargs)
@@ -1273,7 +1678,7 @@ async def send_long_message(update, text: str, **kwargs):
             # 1-й повтор: экранируем # и . вне кода
             safe_chunk = _escape_hash_and_dot_outside_code(chunk)
             try:
-                if rest:
+                if pos < n:
                     await update.message.reply_text(safe_chunk, **common_kwargs)
                 else:
                     await update.message.reply_text(safe_chunk, **last_kwargs)
@@ -1281,79 +1686,83 @@ async def send_long_message(update, text: str, **kwargs):
                 # 2-й повтор: экранируем '-' вне кода, сохраняя '- ' маркеры
                 safer_chunk = _escape_hyphens_outside_code(safe_chunk)
                 try:
-                    if rest:
+                    if pos < n:
                         await update.message.reply_text(safer_chunk, **common_kwargs)
                     else:
                         await update.message.reply_text(safer_chunk, **last_kwargs)
                 except BadRequest as e: # This is the innermost BadRequest
                     logger.warning(f"Failed to send chunk with MarkdownV2 after all escapes. Sending as plain text. Error: {e}", exc_info=True)
                     cleaned_final_chunk = _clean_text_for_plain_send(chunk)
-                    if rest:
+                    if pos < n:
                         plain_kwargs = {k: v for k, v in common_kwargs.items() if k != 'parse_mode'}
                         await update.message.reply_text(cleaned_final_chunk, parse_mode=None, **plain_kwargs)
                     else:
                         plain_kwargs = {k: v for k, v in last_kwargs.items() if k != 'parse_mode'}
                         await update.message.reply_text(cleaned_final_chunk, parse_mode=None, **plain_kwargs)
 
-async def process_buffered_messages(context: ContextTypes.DEFAULT_TYPE) -> None:
-    """Processes the buffered messages for a user after the timeout."""
-    chat_id = context.job.chat_id
-
-    # Immediately retrieve and clear the user's data to avoid race conditions
-    buffered_messages = user_message_buffers.pop(chat_id, [])
-    last_update = user_last_update.pop(chat_id, None)
-    user_job_trackers.pop(chat_id, None)
-
-    if not buffered_messages or not last_update:
-        logger.warning(f"process_buffered_messages called for chat {chat_id} with no data.")
+async def flush_pending_buffers(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Single periodic job: flushes every chat whose debounce window has passed."""
+    now = time.monotonic()
+    ready = [chat_id for chat_id, last_ts in user_last_activity.items()
+             if now - last_ts >= BUFFER_DEBOUNCE_SECONDS]
+    if not ready:
         return
 
-    full_query_text = " ".join(buffered_messages) # Join messages with a space
+    request_queue = context.application.bot_data["request_queue"]
+    for chat_id in ready:
+        # Immediately retrieve and clear the user's data to avoid race conditions
+        buffered_messages = user_message_buffers.pop(chat_id, None)
+        last_update = user_last_update.pop(chat_id, None)
+        chat_context = user_chat_contexts.pop(chat_id, None)
+        user_last_activity.pop(chat_id, None)
+
+        if not buffered_messages or not last_update or chat_context is None:
+            logger.warning(f"Buffer flush for chat {chat_id} found no data.")
+            continue
 
-    logger.info(f"Processing buffered messages for chat {chat_id}. Total messages: {len(buffered_messages)}, Combined length: {len(full_query_text)}.")
+        full_query_text = " ".join(buffered_messages) # Join messages with a space
 
-    MAX_MESSAGE_LENGTH = 12000
-    if len(full_query_text) > MAX_MESSAGE_LENGTH:
-        lang = last_update.effective_user.language_code
-        translator = context.application.bot_data['translator']
-        await last_update.message.reply_text(translator.get_string("error_message_too_long", lang))
-        logger.warning(f"Buffered query for chat {chat_id} exceeded max length ({len(full_query_text)} > {MAX_MESSAGE_LENGTH}).")
-        return
+        logger.info(f"Processing buffered messages for chat {chat_id}. Total messages: {len(buffered_messages)}, Combined length: {len(full_query_text)}.")
 
-    # Determine priority based on the mode
-    mode = context.chat_data.get('mode', 'fast_reply')
-    priorities = {
-        "fast_reply": 1,  # Highest priority for fast answers
-        "web": 2,
-        "deepseek_r1": 3,
-        "deep_search": 4,
-        "deep_research": 5,  # Lowest priority for the most intensive task
-    }
-    priority = priorities.get(mode, 3)  # Default to 3
+        if len(full_query_text) > _MAX_MESSAGE_LENGTH:
+            lang = last_update.effective_user.language_code
+            translator = context.application.bot_data['translator']
+            await last_update.message.reply_text(translator.get_string("error_message_too_long", lang))
+            logger.warning(f"Buffered query for chat {chat_id} exceeded max length ({len(full_query_text)} > {_MAX_MESSAGE_LENGTH}).")
+            continue
 
-    # Get the request queue from bot_data
-    request_queue = context.application.bot_data["request_queue"]
-    request = Request(update=last_update, context=context, chat_id=chat_id, query=full_query_text)
-    await request_queue.put((priority, request))
+        # Determine priority based on the mode
+        mode = chat_context.chat_data.get('mode', 'fast_reply')
+        priority = _PRIORITIES.get(mode, _DEFAULT_PRIORITY)
+
+        request = Request(update=last_update, context=chat_context, chat_id=chat_id, query=full_query_text)
+        request_queue.put_nowait((priority, request))
 
-    logger.info(f"Buffered query for chat {chat_id} (mode: {mode}, priority: {priority}) submitted to main queue.")
+        logger.info(f"Buffered query for chat {chat_id} (mode: {mode}, priority: {priority}) submitted to main queue.")
 
 # ---------------------------------------------------------------------------#
 #                                   Main                                     #
 # ---------------------------------------------------------------------------#
 
 async def main_async() -> None:
-    torch.set_num_threads(4)
+    # Size the torch intra-op pool to the host instead of a hardcoded 4:
+    # half the cores keeps inference fast without starving the event loop
+    # and the whisper/reranker worker threads of CPU time
+    cpu_count = os.cpu_count() or 4
+    torch.set_num_threads(max(1, cpu_count // 2))
+    torch.set_num_interop_threads(2)
     translator = Translator('translations.json')
-    request_queue = asyncio.PriorityQueue()
-    llm_semaphore = asyncio.Semaphore(5)
+    _freeze_static_keyboards(translator)
+    request_queue = FastPriorityQueue()
+    llm_budget = TokenBudget(config.LLM_TOKENS_PER_MINUTE, config.LLM_MAX_CONCURRENCY)
     # Load the reranker model once at startup
     logger.info("Loading reranker model...")
-    reranker_instance = reranker.Reranker(config.RERANK_MODEL)
+    reranker_instance = reranker.BatchingReranker(reranker.Reranker(config.RERANK_MODEL))
     logger.info("Reranker model loaded.")
-    logger.info("Loading whisper model...")
-    whisper_model = whisper.load_model("base")
-    logger.info("Whisper model loaded.")
+    # Pin all spaCy models too, so no request pays the first-use load
+    logger.info("Preloading spaCy models...")
+    entity_detector.preload_nlp_models()
+    logger.info("spaCy models preloaded.")
     worker_count = 3
 
     application = (
@@ -1368,15 +1777,22 @@ async def main_async() -> None:
 
     application.bot_data["translator"] = translator
     application.bot_data["request_queue"] = request_queue
-    application.bot_data["llm_semaphore"] = llm_semaphore
+    application.bot_data["llm_budget"] = llm_budget
     application.bot_data["reranker"] = reranker_instance # Add reranker to bot_data
-    application.bot_data["whisper_model"] = whisper_model
+    # One SearchClient per process so keep-alive connections are reused across handlers
+    application.bot_data["search_client"] = search_client.SearchClient(
+        search_backend=config.SEARCH_BACKEND,
+        api_key=config.YANDEX_API_KEY,
+    )
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CallbackQueryHandler(button))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     application.add_handler(MessageHandler(filters.VOICE, handle_voice_message))
 
+    # One global tick flushes all chat buffers instead of a Job per message
+    application.job_queue.run_repeating(flush_pending_buffers, interval=BUFFER_FLUSH_INTERVAL)
+
     workers = [
         asyncio.create_task(worker(f"Worker-{i+1}", request_queue, application.bot_data))
         for i in range(worker_count)
@@ -1415,6 +1831,7 @@ async def main_async() -> None:
             if not w.done():
                 w.cancel()
         await asyncio.gather(*workers, return_exceptions=True)
+        await page_processor.close_session()
         logger.info("Bot has been shut down.")
 
 def main() -> None:
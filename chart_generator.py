@@ -1,8 +1,12 @@
+import asyncio
+import io
 import logging
-import re
+from concurrent.futures import ThreadPoolExecutor
 from together import error
+import matplotlib
+matplotlib.use('Agg')  # headless backend, no GUI init
 import matplotlib.pyplot as plt
-import json
+import orjson
 import os
 import uuid
 import config
@@ -15,13 +19,10 @@ THINKING_GUIDANCE = (
     "Keep all reasoning inside the <tool_call> block and provide the final answer only after the closing </tool_call> tag."
 )
 
-async def get_chart_data_from_text(article_text: str, llm_client, model: str) -> str:
-    """
-    Asks the LLM to extract chart data from a given text using the provided client.
-    """
-    logger.info(f"--- Article Text Sent to LLM for Chart Extraction ---\n{article_text[:500]}...\n---------------------------------")
-    
-    prompt = f'''You are a fact extractor for visualization. Analyze the article text and return ONE chart as STRICT JSON. No explanations, no Markdown, no code — only valid JSON.
+# The chart prompt is ~1.5KB of constant text; building the whole f-string per
+# call reallocates it every time. Only article_text varies, so the constant
+# prefix/suffix are rendered once at import.
+_CHART_PROMPT_PREFIX = f'''You are a fact extractor for visualization. Analyze the article text and return ONE chart as STRICT JSON. No explanations, no Markdown, no code — only valid JSON.
 
 TASK
 1) Read my research article and try to visualize some important findings.
@@ -61,10 +62,65 @@ Constraints:
 {THINKING_GUIDANCE}
 
 ARTICLE TEXT:
-{article_text}
+'''
+
+_CHART_PROMPT_SUFFIX = '''
 
 ANSWER WITH EXACTLY ONE JSON OBJECT FOLLOWING ONE OF THE TWO SCHEMAS. NO ADDITIONAL TEXT.
 '''
+
+def _strip_think_blocks(text: str) -> str:
+    """Removes <think>...</think> blocks with find/slice instead of regex."""
+    out = []
+    pos = 0
+    while True:
+        start = text.find('<think>', pos)
+        if start == -1:
+            out.append(text[pos:])
+            return ''.join(out)
+        end = text.find('</think>', start)
+        if end == -1:
+            # unclosed block stays, matching the old non-greedy regex
+            out.append(text[pos:])
+            return ''.join(out)
+        out.append(text[pos:start])
+        pos = end + len('</think>')
+
+def _extract_json(text: str) -> str:
+    """Returns the first balanced {...} block via a one-pass brace-depth scan.
+
+    The old greedy r'\\{.*\\}' could backtrack catastrophically when the
+    response contains many '}' characters (JSON-in-JSON)."""
+    start = text.find('{')
+    if start == -1:
+        return ""
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        c = text[i]
+        if escaped:
+            escaped = False
+        elif c == '\\':
+            escaped = True
+        elif c == '"':
+            in_string = not in_string
+        elif not in_string:
+            if c == '{':
+                depth += 1
+            elif c == '}':
+                depth -= 1
+                if depth == 0:
+                    return text[start:i + 1]
+    return ""
+
+async def get_chart_data_from_text(article_text: str, llm_client, model: str) -> str:
+    """
+    Asks the LLM to extract chart data from a given text using the provided client.
+    """
+    logger.info(f"--- Article Text Sent to LLM for Chart Extraction ---\n{article_text[:500]}...\n---------------------------------")
+    
+    prompt = ''.join((_CHART_PROMPT_PREFIX, article_text, _CHART_PROMPT_SUFFIX))
     
     logger.info(f"Prompting model {model} for chart data...")
     try:
@@ -77,11 +133,11 @@ ANSWER WITH EXACTLY ONE JSON OBJECT FOLLOWING ONE OF THE TWO SCHEMAS. NO ADDITIO
         )
         response_text = response.choices[0].message.content.strip()
         
-        cleaned_text = re.sub(r'<think>.*?</think>', '', response_text, flags=re.S).strip()
-        
-        json_match = re.search(r'\{.*\}', cleaned_text, re.S)
-        if json_match:
-            return json_match.group(0)
+        cleaned_text = _strip_think_blocks(response_text).strip()
+
+        chart_json = _extract_json(cleaned_text)
+        if chart_json:
+            return chart_json
         else:
             logger.warning(f"No JSON object found in cleaned response from chart generator: {cleaned_text}")
             return ""
@@ -92,11 +148,22 @@ ANSWER WITH EXACTLY ONE JSON OBJECT FOLLOWING ONE OF THE TWO SCHEMAS. NO ADDITIO
         logger.error(f"An unexpected error occurred during chart generation API call: {e}", exc_info=True)
     return ""
 
-def draw_chart(chart_data: dict, output_dir: str) -> tuple[str, str] | None:
+# One Figure reused across calls: creating/destroying a figure per chart
+# throws away axes objects and font caches. Safe while draw_chart runs on a
+# single thread at a time.
+_FIG = None
+
+# Dedicated single worker: keeps rendering off the event loop and off the
+# shared default pool, and serializes access to the reused figure
+_RENDER_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="chart-render")
+
+def draw_chart(chart_data: dict, output_dir: str) -> tuple[bytes, str, str] | None:
     """
-    Draws a chart based on the provided data and saves it as a PNG file.
-    Returns the file path and title, or None on failure.
+    Draws a chart based on the provided data, rendering to memory and saving
+    a PNG copy for the generated article.
+    Returns the PNG bytes, file path and title, or None on failure.
     """
+    global _FIG
     try:
         chart_type = chart_data.get("chart_type")
         title = chart_data.get("title", "Chart")
@@ -116,48 +183,58 @@ def draw_chart(chart_data: dict, output_dir: str) -> tuple[str, str] | None:
         x_values = [item['x'] for item in data]
         y_values = [item['y'] for item in data]
 
-        plt.figure(figsize=(10, 6))
+        if _FIG is None:
+            _FIG = plt.figure(figsize=(10, 6))
+        fig = _FIG
+        fig.clf()
+        ax = fig.add_subplot(111)
 
         if chart_type == "bar":
-            plt.bar(x_values, y_values)
+            ax.bar(x_values, y_values)
         elif chart_type == "line":
-            plt.plot(x_values, y_values, marker='o')
+            ax.plot(x_values, y_values, marker='o')
         elif chart_type == "pie":
-            plt.pie(y_values, labels=x_values, autopct='%1.1f%%', startangle=90)
-            plt.axis('equal')
+            ax.pie(y_values, labels=x_values, autopct='%1.1f%%', startangle=90)
+            ax.axis('equal')
         else:
             logger.warning(f"Unsupported chart type: {chart_type}")
             return None
 
-        plt.title(title)
-        
+        ax.set_title(title)
+
         if chart_type != "pie":
-            plt.xlabel(x_label)
+            ax.set_xlabel(x_label)
             y_axis_label = f"{y_label}{f' ({unit})' if unit else ''}"
-            plt.ylabel(y_axis_label)
-            plt.xticks(rotation=45, ha='right')
+            ax.set_ylabel(y_axis_label)
+            for tick_label in ax.get_xticklabels():
+                tick_label.set_rotation(45)
+                tick_label.set_ha('right')
 
-        plt.tight_layout()
+        fig.tight_layout()
 
+        # Render once to memory; the caller sends these bytes to Telegram
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png')
+        png_bytes = buf.getvalue()
+
+        # A copy still goes to disk — the generated article links to it
         os.makedirs(output_dir, exist_ok=True)
-        
         filename = f"{str(uuid.uuid4())[:16]}.png"
         filepath = os.path.join(output_dir, filename)
-        
-        plt.savefig(filepath)
-        plt.close()
-        
+        with open(filepath, 'wb') as f:
+            f.write(png_bytes)
+
         logger.info(f"Chart saved to {filepath}")
-        return filepath, title
+        return png_bytes, filepath, title
 
     except Exception as e:
         logger.error(f"Failed to draw chart: {e}", exc_info=True)
         return None
 
-async def generate_chart(article_text: str, llm_client, output_dir: str) -> tuple[str, str] | None:
+async def generate_chart(article_text: str, llm_client, output_dir: str) -> tuple[bytes, str, str] | None:
     """
     Generates chart data from text, draws the chart, and saves it.
-    Returns the file path and title of the chart image if successful.
+    Returns the PNG bytes, file path and title of the chart if successful.
     """
     chart_json_str = await get_chart_data_from_text(article_text, llm_client, config.TOGETHER_DEEPSEEK)
     
@@ -166,8 +243,8 @@ async def generate_chart(article_text: str, llm_client, output_dir: str) -> tupl
         return None
         
     try:
-        chart_data = json.loads(chart_json_str)
-    except json.JSONDecodeError:
+        chart_data = orjson.loads(chart_json_str)
+    except orjson.JSONDecodeError:
         logger.warning(f"Failed to decode JSON from chart generator: {chart_json_str}")
         return None
 
@@ -175,4 +252,7 @@ async def generate_chart(article_text: str, llm_client, output_dir: str) -> tupl
         logger.info(f"Chart generation skipped: {chart_data.get('reason')}")
         return None
 
-    return draw_chart(chart_data, output_dir)
+    # Matplotlib rendering is a few hundred ms of synchronous work —
+    # run it on the render thread so the loop keeps serving other chats
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_RENDER_EXECUTOR, draw_chart, chart_data, output_dir)
@@ -1,9 +1,9 @@
+import functools
 import spacy
-import re
 
-# A regex to find leading conjunctions and similar words in different languages
+# Leading conjunctions and similar words in different languages
 # Covers: and, y, und, et, и, serta, dan, ve, etc.
-LEADING_CONJUNCTION_REGEX = re.compile(r"^(\s*(and|y|und|et|и|serta|dan|ve)\s+)", re.IGNORECASE)
+_CONJUNCTION_WORDS = frozenset({"and", "y", "und", "et", "и", "serta", "dan", "ve"})
 
 # Map language codes to spaCy model names
 LANG_MODEL_MAP = {
@@ -35,9 +35,52 @@ def load_nlp_model(lang: str):
             raise
     return _nlp_models[model_name]
 
+def preload_nlp_models():
+    """Eagerly loads and warms every configured model.
+
+    Called at startup so the first request in each language doesn't pay the
+    disk read + model init (and Thinc kernel warmup) inside the request path;
+    it also removes the race of concurrent first-use spacy.load calls.
+    """
+    for lang in LANG_MODEL_MAP:
+        load_nlp_model(lang)
+    for nlp in _nlp_models.values():
+        nlp("warmup")
+
+@functools.lru_cache(maxsize=512)
+def _parse(lang: str, text: str):
+    """Parses text with the model for `lang`, caching the resulting Doc.
+
+    Retries and follow-ups often re-submit the same query; the cache lets them
+    skip the full pipeline run, which costs hundreds of ms per call.
+    """
+    return load_nlp_model(lang)(text)
+
 def _clean_entity_text(text: str) -> str:
-    """Removes leading conjunctions from the detected entity text."""
-    return LEADING_CONJUNCTION_REGEX.sub("", text).strip()
+    """Removes a leading conjunction from the detected entity text.
+
+    Plain prefix checks instead of a regex: called per entity in the
+    detection loops, and the common case is no match."""
+    stripped = text.lstrip()
+    lowered = stripped.lower()
+    for conj in _CONJUNCTION_WORDS:
+        if (lowered.startswith(conj) and len(stripped) > len(conj)
+                and stripped[len(conj)].isspace()):
+            return stripped[len(conj):].strip()
+    return text.strip()
+
+def _entity_lemma(ent) -> str:
+    """Builds the lemma string for an entity span from the already-parsed doc.
+
+    The lemmas and POS tags were computed during the initial pipeline run, so
+    slicing the span avoids re-running the full pipeline on the entity text.
+    """
+    tokens = list(ent)
+    while tokens and tokens[0].lower_ in _CONJUNCTION_WORDS:
+        tokens = tokens[1:]
+    return " ".join(
+        token.lemma_ for token in tokens if token.pos_ in ('NOUN', 'PROPN', 'ADJ')
+    ).strip()
 
 def detect_entities(text: str, lang: str) -> list:
     """
@@ -45,52 +88,50 @@ def detect_entities(text: str, lang: str) -> list:
     then with a broad multilingual model to catch additional entities.
     """
     # --- First Pass: Language-Specific Model ---
-    nlp_specific = load_nlp_model(lang)
-    doc_specific = nlp_specific(text)
+    doc_specific = _parse(lang, text)
     entities = []
     found_entity_texts = set()
+    found_token_sets: list[frozenset[str]] = []
 
     for ent in doc_specific.ents:
         cleaned_text = _clean_entity_text(ent.text)
         if not cleaned_text:
             continue
 
-        # Re-process the cleaned text to get the correct lemma
-        cleaned_doc = nlp_specific(cleaned_text)
-        lemmatized_parts = [
-            token.lemma_
-            for token in cleaned_doc
-            if token.pos_ in ['NOUN', 'PROPN', 'ADJ']
-        ]
-        lemmatized_entity_text = " ".join(lemmatized_parts).strip()
+        # Slice the lemma out of the already-parsed doc instead of re-running
+        # the whole pipeline on the cleaned entity text
+        lemmatized_entity_text = _entity_lemma(ent)
 
         if lemmatized_entity_text and lemmatized_entity_text not in found_entity_texts:
             # Use the original label but the cleaned text and lemma
             entities.append({"text": cleaned_text, "label": ent.label_, "lemma": lemmatized_entity_text})
             found_entity_texts.add(lemmatized_entity_text)
+            found_token_sets.append(frozenset(lemmatized_entity_text.lower().split()))
 
     # --- Second Pass: Multilingual Model for Fallback ---
     specific_model_name = LANG_MODEL_MAP.get(lang, "xx_ent_wiki_sm")
     if specific_model_name != "xx_ent_wiki_sm":
-        nlp_multi = load_nlp_model('xx') # 'xx' will load 'xx_ent_wiki_sm'
-        doc_multi = nlp_multi(text)
+        doc_multi = _parse('xx', text) # 'xx' will load 'xx_ent_wiki_sm'
         for ent in doc_multi.ents:
             cleaned_text = _clean_entity_text(ent.text)
             if not cleaned_text:
                 continue
 
             # Attempt to lemmatize the multilingual entity for better deduplication
-            multi_lemmatized_text = " ".join([token.lemma_ for token in nlp_multi(cleaned_text) if token.pos_ in ['NOUN', 'PROPN', 'ADJ']]).strip()
+            multi_lemmatized_text = _entity_lemma(ent)
             if not multi_lemmatized_text: # Fallback if lemmatization fails
                 multi_lemmatized_text = cleaned_text
 
-            if cleaned_text and multi_lemmatized_text.lower() not in {e.lower() for e in found_entity_texts}:
-                is_new = True
-                for found_lemma in found_entity_texts:
-                    if multi_lemmatized_text in found_lemma or found_lemma in multi_lemmatized_text:
-                        is_new = False
-                        break
-                if is_new:
-                    entities.append({"text": cleaned_text, "label": ent.label_, "lemma": multi_lemmatized_text})
-                    found_entity_texts.add(multi_lemmatized_text)
+            # O(1) exact-duplicate check before the containment scan
+            if multi_lemmatized_text in found_entity_texts:
+                continue
+
+            # Token-subset containment instead of pairwise substring scans:
+            # frozenset comparisons are C-level and don't flag partial-word
+            # overlaps the way character substrings do
+            new_tokens = frozenset(multi_lemmatized_text.lower().split())
+            if not any(new_tokens <= found or found <= new_tokens for found in found_token_sets):
+                entities.append({"text": cleaned_text, "label": ent.label_, "lemma": multi_lemmatized_text})
+                found_entity_texts.add(multi_lemmatized_text)
+                found_token_sets.append(new_tokens)
     return entities
@@ -4,8 +4,9 @@ import httpx
 from typing import List, Dict, Any
 
 from entity_detector import detect_entities, load_nlp_model
+from utils import async_query_cache
 from wikidata_mapper import get_qid_from_entity, _get_p31_for_qid
-from wikidata_fetcher import get_wikidata_description, get_wikipedia_lead_paragraph
+from wikidata_fetcher import get_wikidata_descriptions, get_wikipedia_lead_paragraph
 
 logger = logging.getLogger(__name__)
 
@@ -13,8 +14,27 @@ logger = logging.getLogger(__name__)
 # This helps prevent "429 Too Many Requests" errors.
 WIKIDATA_SEMAPHORE = asyncio.Semaphore(3)
 
-async def _process_single_entity(client, search_term: str, lang: str, spacy_label: str = None) -> Dict[str, Any]:
-    """Processes a single entity, trying user's lang first, then falling back to English."""
+# Stage timeouts: one stuck Wikidata/Wikipedia request shouldn't hold the
+# whole entity lookup hostage — stragglers are cancelled and skipped.
+QID_LOOKUP_TIMEOUT = 15.0
+LEAD_PARAGRAPH_TIMEOUT = 10.0
+
+# One client for the module lifetime: Wikidata/Wikipedia lookups reuse pooled
+# keep-alive connections instead of paying TLS setup on every query.
+_http_client: httpx.AsyncClient | None = None
+
+def _get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            # fail fast per request; the stage timeouts are the upper bound
+            timeout=httpx.Timeout(5.0, connect=2.0),
+            limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        )
+    return _http_client
+
+async def _resolve_entity_qid(client, search_term: str, lang: str, spacy_label: str = None) -> str | None:
+    """Resolves an entity to a Q-ID, trying user's lang first, then falling back to English."""
     async with WIKIDATA_SEMAPHORE:
         # Try to find the entity in the user's language first
         qid = await get_qid_from_entity(client, search_term, lang, spacy_label=spacy_label)
@@ -23,18 +43,13 @@ async def _process_single_entity(client, search_term: str, lang: str, spacy_labe
         if not qid and lang != 'en':
             qid = await get_qid_from_entity(client, search_term, 'en', spacy_label=spacy_label)
 
-        if qid:
-            description = await get_wikidata_description(client, qid, lang)
-            lead_paragraph = await get_wikipedia_lead_paragraph(client, qid, lang)
-            return {
-                "entity": search_term,
-                "description": description,
-                "qid": qid,
-                "wikipedia_url": None, # This function does not return a URL
-                "lead_paragraph": lead_paragraph,
-            }
-    return None
+        return qid
 
+async def _fetch_lead_paragraph(client, qid: str, lang: str) -> str | None:
+    async with WIKIDATA_SEMAPHORE:
+        return await get_wikipedia_lead_paragraph(client, qid, lang)
+
+@async_query_cache(maxsize=4096)
 async def get_entity_info(query: str, lang: str) -> List[Dict]:
     """
     Asynchronously detects entities using spaCy's built-in NER and fetches their details.
@@ -49,18 +64,57 @@ async def get_entity_info(query: str, lang: str) -> List[Dict]:
 
     logger.info(f"Successfully detected entities via spaCy NER: {[ent['text'] for ent in detected_entities]}")
 
-    async with httpx.AsyncClient() as client:
-        # Create a list of unique entity texts to avoid duplicate lookups
-        # Each entity is now a dict with 'text', 'label', and 'lemma' keys
-        unique_entities = {}
-        for ent in detected_entities:
-            if ent['text'] not in unique_entities:
-                unique_entities[ent['text']] = ent['label']
-        
-        # Process entities with their labels for better disambiguation
-        tasks = [_process_single_entity(client, text, lang, spacy_label=label) 
-                 for text, label in unique_entities.items()]
-        results = await asyncio.gather(*tasks)
-    
-    # Filter out None results for entities that were not found in Wikidata
-    return [info for info in results if info is not None]
+    client = _get_http_client()
+
+    # Create a list of unique entity texts to avoid duplicate lookups
+    # Each entity is now a dict with 'text', 'label', and 'lemma' keys
+    unique_entities = {}
+    for ent in detected_entities:
+        if ent['text'] not in unique_entities:
+            unique_entities[ent['text']] = ent['label']
+
+    # Resolve Q-IDs concurrently, with labels for better disambiguation;
+    # entities whose lookup outlives the stage timeout are dropped
+    terms = list(unique_entities.items())
+    qid_tasks = [
+        asyncio.create_task(_resolve_entity_qid(client, text, lang, spacy_label=label))
+        for text, label in terms
+    ]
+    done, pending = await asyncio.wait(qid_tasks, timeout=QID_LOOKUP_TIMEOUT)
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning(f"Skipped {len(pending)} entity lookup(s) that exceeded {QID_LOOKUP_TIMEOUT}s.")
+
+    resolved = []
+    for (text, _), task in zip(terms, qid_tasks):
+        if task in done and not task.exception() and task.result():
+            resolved.append((text, task.result()))
+    if not resolved:
+        return []
+
+    # One batched wbgetentities roundtrip for all descriptions instead of
+    # one SPARQL query per entity; lead paragraphs stay per-entity because
+    # the Wikipedia summary API is per-title
+    descriptions = await get_wikidata_descriptions(client, [qid for _, qid in resolved], lang)
+    lead_tasks = [
+        asyncio.create_task(_fetch_lead_paragraph(client, qid, lang)) for _, qid in resolved
+    ]
+    done, pending = await asyncio.wait(lead_tasks, timeout=LEAD_PARAGRAPH_TIMEOUT)
+    for task in pending:
+        task.cancel()
+    lead_paragraphs = [
+        task.result() if task in done and not task.exception() else None
+        for task in lead_tasks
+    ]
+
+    return [
+        {
+            "entity": text,
+            "description": descriptions.get(qid),
+            "qid": qid,
+            "wikipedia_url": None, # This function does not return a URL
+            "lead_paragraph": lead_paragraph,
+        }
+        for (text, qid), lead_paragraph in zip(resolved, lead_paragraphs)
+    ]
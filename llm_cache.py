@@ -0,0 +1,41 @@
+import hashlib
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Calls sampled above this temperature are expected to vary between runs,
+# so caching them would pin one arbitrary generation forever.
+CACHEABLE_TEMPERATURE = 0.3
+
+class LLMCache:
+    """Exact-match cache for near-deterministic LLM calls.
+
+    Keyed by a sha256 over the model and the sorted payload items, so any
+    change to the prompt, model or sampling params is a miss. A cache hit
+    skips the entire model forward pass. LRU-bounded.
+    """
+
+    def __init__(self, maxsize: int = 1024):
+        self._store: OrderedDict[str, str] = OrderedDict()
+        self._maxsize = maxsize
+
+    @staticmethod
+    def key(payload: dict) -> str | None:
+        """Returns the cache key for a request payload, or None if the call
+        is too hot (temperature) to cache."""
+        if payload.get("temperature", 1.0) > CACHEABLE_TEMPERATURE:
+            return None
+        return hashlib.sha256(repr(sorted(payload.items())).encode()).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        value = self._store.get(key)
+        if value is not None:
+            self._store.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str) -> None:
+        self._store[key] = value
+        self._store.move_to_end(key)
+        while len(self._store) > self._maxsize:
+            self._store.popitem(last=False)
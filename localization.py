@@ -1,23 +1,59 @@
-import json
+import orjson
+from functools import lru_cache
+from string import Formatter
 from typing import Dict, Any
 
+_FORMATTER = Formatter()
+
 class Translator:
     def __init__(self, translations_file: str):
-        with open(translations_file, 'r', encoding='utf-8') as f:
-            self.translations: Dict[str, Dict[str, str]] = json.load(f)
+        with open(translations_file, 'rb') as f:
+            self.translations: Dict[str, Dict[str, str]] = orjson.loads(f.read())
         self.supported_languages = list(self.translations.keys())
+        # Cache the (key, lang) -> template resolution; the fallback chain and
+        # dict lookups run once per pair instead of on every message.
+        self._resolve = lru_cache(maxsize=2048)(self._lookup)
+        # Templates parse once into (literal, field) segments; re-parsing the
+        # format string on every get_string call is the hot part of str.format.
+        self._compile = lru_cache(maxsize=2048)(self._parse_template)
 
-    def get_string(self, key: str, lang_code: str, **kwargs: Any) -> str:
-        """Gets a translated string, falling back to English if the language or key is not found."""
+    @staticmethod
+    def _parse_template(template: str) -> list | None:
+        """Splits a template into (literal, field) segments.
+
+        Returns None for templates needing full str.format semantics
+        (format specs, conversions, positional or nested fields)."""
+        segments = []
+        for literal, field, spec, conversion in _FORMATTER.parse(template):
+            if spec or conversion or (field is not None and not field.isidentifier()):
+                return None
+            segments.append((literal, field))
+        return segments
+
+    def _lookup(self, key: str, lang_code: str) -> str | None:
         # Fallback to English if the language is not supported
         if lang_code not in self.supported_languages:
             lang_code = 'en'
 
         # Get the string, falling back to the English version of the string if the key is missing
-        string = self.translations.get(lang_code, {}).get(key) or self.translations.get('en', {}).get(key)
+        return self.translations.get(lang_code, {}).get(key) or self.translations.get('en', {}).get(key)
+
+    def get_string(self, key: str, lang_code: str, **kwargs: Any) -> str:
+        """Gets a translated string, falling back to English if the language or key is not found."""
+        string = self._resolve(key, lang_code)
 
         if not string:
             # Ultimate fallback if a key is not in English either
             return f"<translation_missing: {key}>"
 
-        return string.format(**kwargs)
+        segments = self._compile(string)
+        if segments is None:
+            return string.format(**kwargs)
+
+        parts = []
+        for literal, field in segments:
+            if literal:
+                parts.append(literal)
+            if field is not None:
+                parts.append(str(kwargs[field]))
+        return ''.join(parts)
@@ -1,79 +1,255 @@
+import asyncio
+import functools
+import hashlib
+import heapq
 import httpx
-import json
+import ijson
+import json5
+import orjson
 import logging
 import re
-from urllib.parse import urlparse
+from collections import defaultdict
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
 
 import config
 from config import OLLAMA_ENDPOINT, OLLAMA_MODEL, FACTUAL_PARAMS, DEEP_SEARCH_STEP_ONE_MODEL, CREATIVE_PARAMS, FACTUAL_PARAMS_2, DEEP_SEARCH_STEP_ONE_MODEL, DEEP_SEARCH_STEP_FINAL_MODEL, OLLAMA_TIMEOUT
-from utils import detect_language, _filter_duplicate_chunks
+from utils import choose_prompt_lang, detect_language, _chunk_key, _filter_duplicate_chunks
+from llm_cache import LLMCache
 
-from together import Together
+from together import AsyncTogether
 
 logger = logging.getLogger(__name__)
 
-async def get_sub_queries(query: str, lang: str) -> list[str]:
-    detected_user_lang = detect_language(query)
-    if detected_user_lang == 'en':
-        prompt_lang = 'en'
+# One pooled client for the module lifetime: every Ollama call reuses a
+# keep-alive connection to the local server instead of opening (and tearing
+# down) a fresh socket per request.
+_client: httpx.AsyncClient | None = None
+
+def _get_client() -> httpx.AsyncClient:
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(OLLAMA_TIMEOUT, connect=5),
+            # Sized for the research fan-out: parallel sub-queries and steps
+            # all hit the same host, and long-lived keep-alives skip the
+            # reconnect between pipeline stages
+            limits=httpx.Limits(
+                max_connections=64,
+                max_keepalive_connections=32,
+                keepalive_expiry=300,
+            ),
+        )
+    return _client
+
+# Exact-match cache for the low-temperature endpoints; a repeated query
+# returns instantly instead of paying a full model forward pass
+_llm_cache = LLMCache(maxsize=1024)
+
+# Compiled once: these run on every response, and precompiling skips the
+# re-module cache lookup per call
+_NUMBERED_LIST = re.compile(r'\d+\.\s*"(.*?)"|\d+\.\s*(.*)')
+_CJK = re.compile(r'[\u4e00-\u9fff]')
+
+# Payloads are serialized with orjson (C-level, ~5-10x faster than the
+# stdlib encoder httpx would use for json=), so the content type is ours
+# to set
+_JSON_HEADERS = {"content-type": "application/json"}
+
+# Per-workload timeouts: the quick endpoints (sub-queries, research steps,
+# fast reply) shouldn't wait out the full synthesis budget before erroring.
+# 60s still comfortably covers a local model generating a short list.
+TIMEOUT_FAST = httpx.Timeout(60.0, connect=3.0)
+TIMEOUT_SYNTH = httpx.Timeout(OLLAMA_TIMEOUT, connect=5.0)
+
+# Transient socket-level failures are worth a jittered retry: giving up on
+# the first ReadError can throw away minutes of accumulated research work
+_TRANSIENT_ERRORS = (httpx.ReadError, httpx.ConnectError, httpx.RemoteProtocolError, httpx.ReadTimeout)
+
+@retry(
+    stop=stop_after_attempt(5),
+    wait=wait_random_exponential(min=0.5, max=8),
+    retry=retry_if_exception_type(_TRANSIENT_ERRORS),
+    reraise=True,
+)
+async def _post_extract_text(payload: dict, log_prefix: str, timeout: httpx.Timeout = TIMEOUT_SYNTH) -> str:
+    """POSTs a completion request and stream-decodes choices[0].text.
+
+    ijson parses the body incrementally as the bytes arrive, so the
+    multi-KB synthesis responses are never buffered and materialized as a
+    full dict just to pull out one string.
+    """
+    try:
+        async with _get_client().stream(
+            "POST", OLLAMA_ENDPOINT, content=orjson.dumps(payload),
+            headers=_JSON_HEADERS, timeout=timeout,
+        ) as resp:
+            resp.raise_for_status()
+            async for text in ijson.items(resp.aiter_bytes(), "choices.item.text"):
+                return text.strip()
+    except httpx.RequestError as e:
+        logger.error(f"{log_prefix} - Request failed: {e}")
+        raise
+    raise ValueError(f"{log_prefix} - No choices[].text in the response.")
+
+async def _llm_complete(prompt: str, *, model: str, params: dict, log_prefix: str,
+                        timeout: httpx.Timeout = TIMEOUT_SYNTH) -> str:
+    """Single entry point for plain completion calls.
+
+    Builds the payload and hands it to the pooled, streaming post path,
+    so retries, caching, and timeout changes happen in one place instead
+    of once per endpoint.
+    """
+    payload = {"model": model, "prompt": prompt, **params}
+    return await _post_extract_text(payload, log_prefix, timeout=timeout)
+
+# Two texts are near-duplicates when their SimHashes differ in at most
+# this many bits
+_SIMHASH_MAX_DISTANCE = 3
+
+def _simhash64(text: str) -> int:
+    """64-bit SimHash over word 5-gram shingles of lowercased text."""
+    words = text.lower().split()
+    if len(words) < 5:
+        shingles = [' '.join(words)] if words else []
     else:
-        prompt_lang = lang
+        shingles = [' '.join(words[i:i + 5]) for i in range(len(words) - 4)]
+    weights = [0] * 64
+    for shingle in shingles:
+        h = int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big')
+        for bit in range(64):
+            weights[bit] += 1 if (h >> bit) & 1 else -1
+    fingerprint = 0
+    for bit in range(64):
+        if weights[bit] > 0:
+            fingerprint |= 1 << bit
+    return fingerprint
+
+def _prepare_snippet_context(snippets: list) -> tuple[str, list[str]]:
+    """Builds the per-domain snippet text and top-3 source URLs in one sweep.
+
+    Folds the previous three traversals (duplicate filter, domain grouping,
+    source ranking) into a single loop over the snippets. Sources are
+    ranked by their longest unique snippet; domain groups keep snippets of
+    >= 70 chars, with SimHash-near-duplicates dropped across domains so the
+    model isn't shown the same paragraph twice under different sources.
+    """
+    seen_keys = set()
+    best_len: dict[str, int] = {}
+    by_domain = defaultdict(list)
+    kept_hashes: list[int] = []
+    for s in snippets:
+        if s.text_len >= 70:
+            fingerprint = _simhash64(s.text)
+            if all((fingerprint ^ kept).bit_count() > _SIMHASH_MAX_DISTANCE
+                   for kept in kept_hashes):
+                kept_hashes.append(fingerprint)
+                by_domain[s.domain].append(s.text)
+        key = _chunk_key(s.text)
+        if key in seen_keys:
+            continue
+        seen_keys.add(key)
+        if s.text_len > best_len.get(s.source_url, -1):
+            best_len[s.source_url] = s.text_len
+    snippet_text = "\n\n".join(
+        f"- {' '.join(texts)} [{domain}]" for domain, texts in by_domain.items()
+    )
+    top_sources = heapq.nlargest(3, best_len, key=best_len.get)
+    return snippet_text, top_sources
+
+def _render_entity(entity: dict) -> str:
+    lines = [f"- Entity: {entity['entity']}\n"]
+    if entity['description']:
+        lines.append(f"  Description: {entity['description']}\n")
+    if entity['lead_paragraph']:
+        lines.append(f"  Lead Paragraph: {entity['lead_paragraph']}\n")
+    lines.append(f"  QID: {entity['qid']}\n")
+    return ''.join(lines)
+
+@functools.lru_cache(maxsize=256)
+def _render_entity_context(entities_key: tuple) -> str:
+    """Renders the detailed entity block once per entity set.
+
+    The research pipeline calls generate_summary_from_chunks once per step
+    with the same entities, so the block is cached by its content tuple;
+    the byte-stable result also keeps the prompt prefix identical for the
+    model server's KV cache.
+    """
+    return "\n\nDiscovered Entities and their details:\n" + "".join(
+        _render_entity({'entity': e, 'description': d, 'lead_paragraph': p, 'qid': q})
+        for e, d, p, q in entities_key
+    )
+
+def _entity_context_key(entities_info: list) -> tuple:
+    return tuple(
+        (e['entity'], e['description'], e['lead_paragraph'], e['qid'])
+        for e in entities_info
+    )
+
+# LLM servers reuse KV cache by longest common prompt prefix, so the
+# static persona + rules blocks are rendered once per language and placed
+# before any per-request content (entities, query, snippets).
+
+@functools.lru_cache(maxsize=64)
+def _serp_prompt_prefix(prompt_lang: str) -> str:
+    return f"""You are a skilled researcher. You are able to pick the most relevant data from a very broad context to answer the user's query in a short and precise way. Write a complete, coherent, and fact-rich answer to the user's query from context snippets and discovered entities. Keep only unique and valuable information (guidance, facts, numbers, addresses, characteristics) related to the user's query.
+
+Rules: 1. Max output should be around 10-200 words. 2. Double check you don't repeat yourself and provide only unique and detailed information. 3. Answer in the "{prompt_lang}" language. 4. Stick closer to the language and style of provided context snippets. 5. Information discovered in "Discovered entities and their details" is the most reliable, and it is your final source of truth. 6. If the user query implies a short answer (facts, dates, quick advice etc), keep you answer very short. 7. If the user query implies a long answer (e.g. comparisons, lists, coding, analysis, research etc) provide a detailed answer."""
+
+@functools.lru_cache(maxsize=64)
+def _summary_prompt_prefix(prompt_lang: str) -> str:
+    return f"""You are a skilled researcher. You are able to pick the most relevant data from a very broad context to answer the user's query in a detailed and precise way. Write a complete, coherent, and fact-rich answer to the user's query from context snippets and discovered entities. Keep only unique and valuable information (guidance, facts, numbers, addresses, characteristics) related to the user's query.
+
+Rules: 1. Max output should be around 100-300 words. 2. Double check you don't repeat yourself and provide only unique and detailed information. 3. Answer in the "{prompt_lang}" language. 4. Do not add any information not present in the snippets. 4. Stick closer to the language and style of provided context snippets. 5. Information discovered in "Discovered entities and their details" is the most reliable, and it is your final source of truth."""
+
+def _parse_llm_json_list(response_text: str, log_prefix: str) -> list:
+    """Parses a JSON list out of an LLM response.
+
+    json5 tolerates the comments and trailing commas models tend to emit,
+    replacing the old regex sanitization passes; a numbered-list regex
+    remains as the last-ditch fallback.
+    """
+    start = response_text.find('[')
+    end = response_text.rfind(']')
+    if start != -1 and end > start:
+        try:
+            parsed = json5.loads(response_text[start:end + 1])
+            if isinstance(parsed, list):
+                return parsed
+            logger.warning(f"{log_prefix} - Parsed JSON is not a list: {type(parsed).__name__}")
+        except ValueError as e:
+            logger.warning(f"{log_prefix} - Could not decode JSON list: {e}")
+    else:
+        logger.warning(f"{log_prefix} - No JSON list found in the response.")
+    # Fallback: pull the items out of a numbered list
+    matches = _NUMBERED_LIST.findall(response_text)
+    return [item for sublist in matches for item in sublist if item]
+
+async def get_sub_queries(query: str, lang: str) -> list[str]:
+    prompt_lang = choose_prompt_lang(query, lang)
 
     prompt = f"""Based on the following query, generate up to 10 sub-queries for a web search to gather the necessary information to provide a comprehensive answer. Try both shorter and longer search queries. The majority of them should be in "{prompt_lang}" language, and a couple - in English. Return the sub-queries as a clean JSON list of strings without comments.
 
 Query from user: {query}"""
-    payload = {"model": DEEP_SEARCH_STEP_ONE_MODEL, "prompt": prompt, **CREATIVE_PARAMS}
     logger.info(f"Ollama (sub-queries) - Prompt: {prompt}")
-    try:
-        async with httpx.AsyncClient(timeout=OLLAMA_TIMEOUT) as client:
-            resp = await client.post(OLLAMA_ENDPOINT, json=payload)
-            resp.raise_for_status()
-    except httpx.RequestError as e:
-        logger.error(f"Ollama (sub-queries) - Request failed: {e}")
-        raise
-    response_text = resp.json()["choices"][0]["text"].strip()
+    response_text = await _llm_complete(
+        prompt, model=DEEP_SEARCH_STEP_ONE_MODEL, params=CREATIVE_PARAMS,
+        log_prefix="Ollama (sub-queries)", timeout=TIMEOUT_FAST,
+    )
     logger.info(f"Ollama (sub-queries) - Raw Response: {response_text}")
-    
-    sub_queries = []
-    json_string = ""
-    try:
-        # Extract content between the first '[' and the last ']'
-        json_match = re.search(r'\[[\s\S]*\]', response_text)
-        if json_match:
-            json_string = json_match.group(0)
-            
-            # Remove line comments (//...)
-            json_string = re.sub(r"//.*", "", json_string)
-            
-            # Remove trailing commas before closing brackets or braces
-            json_string = re.sub(r",\s*([\}\]])", r"\1", json_string)
-
-            sub_queries = json.loads(json_string)
-        else:
-             logger.warning("Ollama (sub-queries) - No JSON list found in the response.")
-
-    except json.JSONDecodeError as e:
-        logger.warning(f"Ollama (sub-queries) - Could not decode JSON: {e}. Raw string was: {json_string}")
-        # Fallback to original regex if JSON parsing fails
-        sub_queries = re.findall(r'\d+\.\s*"(.*?)"|\d+\.\s*(.*)', response_text)
-        sub_queries = [item for sublist in sub_queries for item in sublist if item]
 
+    sub_queries = _parse_llm_json_list(response_text, "Ollama (sub-queries)")
     logger.info(f"Ollama (sub-queries) - Parsed Sub-queries: {sub_queries}")
     return sub_queries
 
 
 async def get_research_steps(query: str, lang: str, entities_info: list) -> list[str]:
-    detected_user_lang = detect_language(query)
-    if detected_user_lang == 'en':
-        prompt_lang = 'en'
-    else:
-        prompt_lang = lang
+    prompt_lang = choose_prompt_lang(query, lang)
 
     entity_context = ""
     if entities_info:
-        entity_context = "\n\nDiscovered Entities:\n"
-        for entity in entities_info:
-            entity_context += f"- {entity['entity']}\n"
+        entity_context = "\n\nDiscovered Entities:\n" + "".join(
+            f"- {entity['entity']}\n" for entity in entities_info
+        )
 
     prompt = f"""You are a researcher. Break down the user's question into several logical research steps. Use the provided entity details to create more accurate and specific steps. In each step, instead of pronouns, be sure to indicate the full name of the object(s) of research. Also, in each step, keep the general context of the research (user's request). Do not refer to other steps or to the future results of other steps. If it is absolutely necessary to refer to other steps, then repeat the context of what was in the previous steps.
 
@@ -90,51 +266,19 @@ Query from user: {query}
 """
     if entity_context:
         prompt += f"{entity_context} EACH QUESTION SHOULD CONTAIN AT LEAST ONE ENTITY NAME"
-    payload = {"model": "qwen2.5:14b-instruct-q4_K_M", "prompt": prompt, **CREATIVE_PARAMS}
     logger.info(f"Ollama (research-steps) - Prompt: {prompt}")
-    try:
-        async with httpx.AsyncClient(timeout=OLLAMA_TIMEOUT) as client:
-            resp = await client.post(OLLAMA_ENDPOINT, json=payload)
-            resp.raise_for_status()
-    except httpx.RequestError as e:
-        logger.error(f"Ollama (research-steps) - Request failed: {e}")
-        raise
-    response_text = resp.json()["choices"][0]["text"].strip()
+    response_text = await _llm_complete(
+        prompt, model="qwen2.5:14b-instruct-q4_K_M", params=CREATIVE_PARAMS,
+        log_prefix="Ollama (research-steps)", timeout=TIMEOUT_FAST,
+    )
     logger.info(f"Ollama (research-steps) - Raw Response: {response_text}")
-    
-    steps = []
-    json_string = ""
-    try:
-        # Extract content between the first '[' and the last ']'
-        json_match = re.search(r'\[[\s\S]*\]', response_text)
-        if json_match:
-            json_string = json_match.group(0)
-            
-            # Remove line comments (//...)
-            json_string = re.sub(r"//.*", "", json_string)
-            
-            # Remove trailing commas before closing brackets or braces
-            json_string = re.sub(r",\s*([\}\]])", r"\1", json_string)
-
-            steps = json.loads(json_string)
-        else:
-             logger.warning("Ollama (research-steps) - No JSON list found in the response.")
-
-    except json.JSONDecodeError as e:
-        logger.warning(f"Ollama (research-steps) - Could not decode JSON: {e}. Raw string was: {json_string}")
-        # Fallback to original regex if JSON parsing fails
-        steps = re.findall(r'\d+\.\s*"(.*?)"|\d+\.\s*(.*)', response_text)
-        steps = [item for sublist in sub_queries for item in sublist if item]
 
+    steps = _parse_llm_json_list(response_text, "Ollama (research-steps)")
     logger.info(f"Ollama (research-steps) - Parsed Steps: {steps}")
     return steps
 
 async def synthesize_research_answer(query: str, research_data: dict, lang: str) -> str:
-    detected_user_lang = detect_language(query)
-    if detected_user_lang == 'en':
-        prompt_lang = 'en'
-    else:
-        prompt_lang = lang
+    prompt_lang = choose_prompt_lang(query, lang)
 
     # Format research_data for the LLM prompt
     formatted_research_data = ""
@@ -159,16 +303,11 @@ Example JSON output:
 **Research Data (Summaries of each research item):**
 {formatted_research_data}
 """
-    payload = {"model": "qwen2.5:3b-instruct", "prompt": prompt, **FACTUAL_PARAMS_2}
     logger.info(f"Ollama (research-synthesis) - Prompt: {prompt}")
-    try:
-        async with httpx.AsyncClient(timeout=OLLAMA_TIMEOUT) as client:
-            resp = await client.post(OLLAMA_ENDPOINT, json=payload)
-            resp.raise_for_status()
-    except httpx.RequestError as e:
-        logger.error(f"Ollama (research-synthesis) - Request failed: {e}")
-        raise
-    response_text = resp.json()["choices"][0]["text"].strip()
+    response_text = await _llm_complete(
+        prompt, model="qwen2.5:3b-instruct", params=FACTUAL_PARAMS_2,
+        log_prefix="Ollama (research-synthesis)",
+    )
     logger.info(f"Ollama (research-synthesis) - Response: {response_text}")
     return response_text
 
@@ -179,11 +318,7 @@ async def synthesize_answer(query: str, snippets: list, lang: str) -> str:
     snippet_text = "\n".join([f"- {s.text}" for s in unique_snippets])
     logger.info(f"Ollama (synthesis) - Snippets: {snippet_text}")
 
-    detected_user_lang = detect_language(query)
-    if detected_user_lang == 'en':
-        prompt_lang = 'en'
-    else:
-        prompt_lang = lang
+    prompt_lang = choose_prompt_lang(query, lang)
 
     prompt = f"""You are an expert. Your task is to synthesize a comprehensive, well-structered, and detailed answer based *only* on the provided web search snippets.
 
@@ -196,23 +331,18 @@ async def synthesize_answer(query: str, snippets: list, lang: str) -> str:
 
 **Snippets:**
 {snippet_text}"""
-    payload = {"model": DEEP_SEARCH_STEP_FINAL_MODEL, "prompt": prompt, **FACTUAL_PARAMS_2}
     logger.info(f"Ollama (synthesis) - Prompt: {prompt}")
-    try:
-        async with httpx.AsyncClient(timeout=OLLAMA_TIMEOUT) as client:
-            resp = await client.post(OLLAMA_ENDPOINT, json=payload)
-            resp.raise_for_status()
-    except httpx.RequestError as e:
-        logger.error(f"Ollama (synthesis) - Request failed: {e}")
-        raise
-    response_text = resp.json()["choices"][0]["text"].strip()
+    response_text = await _llm_complete(
+        prompt, model=DEEP_SEARCH_STEP_FINAL_MODEL, params=FACTUAL_PARAMS_2,
+        log_prefix="Ollama (synthesis)",
+    )
     logger.info(f"Ollama (synthesis) - Response: {response_text}")
 
     return response_text
 
 def contains_chinese(text: str) -> bool:
     """Checks if the string contains Chinese characters."""
-    return bool(re.search(r'[\u4e00-\u9fff]', text))
+    return _CJK.search(text) is not None
 
 async def translate_if_needed(query: str, original_answer: str) -> str:
     """Translates the answer if it contains Chinese characters."""
@@ -227,24 +357,15 @@ async def translate_if_needed(query: str, original_answer: str) -> str:
 
     # Step 2: Translate the answer to the detected language
     translation_prompt = f'''Answer the user\'s question in the {detected_language} language. User\'s question: "{query}".'''
-    payload = {"model": "llama3:8b-instruct-q4_K_M", "prompt": translation_prompt, **FACTUAL_PARAMS}
-    try:
-        async with httpx.AsyncClient(timeout=OLLAMA_TIMEOUT) as client:
-            resp = await client.post(OLLAMA_ENDPOINT, json=payload)
-            resp.raise_for_status()
-        translated_answer = resp.json()["choices"][0]["text"].strip()
-        logger.info(f"Ollama (prompt_without_context) - Translated answer: {translated_answer}")
-        return translated_answer
-    except httpx.RequestError as e:
-        logger.error(f"Ollama (prompt_without_context) - Translation failed: {e}")
-        raise
+    translated_answer = await _llm_complete(
+        translation_prompt, model="llama3:8b-instruct-q4_K_M", params=FACTUAL_PARAMS,
+        log_prefix="Ollama (prompt_without_context)",
+    )
+    logger.info(f"Ollama (prompt_without_context) - Translated answer: {translated_answer}")
+    return translated_answer
 
 async def prompt_without_context(query: str, lang: str, model: str = None, params: dict = None) -> str:
-    detected_user_lang = detect_language(query)
-    if detected_user_lang == 'en':
-        prompt_lang = 'en'
-    else:
-        prompt_lang = lang
+    prompt_lang = choose_prompt_lang(query, lang)
 
     prompt = f"""You are a helpful AI assistant. Always answer in the "{prompt_lang}" language!
     
@@ -256,39 +377,49 @@ Question from the user: {query}
     final_params = params if params is not None else FACTUAL_PARAMS
 
     payload = {"model": final_model, "prompt": prompt, **final_params}
+    cache_key = LLMCache.key(payload)
+    if cache_key and (hit := _llm_cache.get(cache_key)) is not None:
+        logger.info("Ollama (prompt_without_context) - Cache hit.")
+        return hit
     logger.info(f"Ollama (prompt_without_context-fallback-no-context) - Prompt: {prompt}")
-    try:
-        async with httpx.AsyncClient(timeout=OLLAMA_TIMEOUT) as client:
-            resp = await client.post(OLLAMA_ENDPOINT, json=payload)
-            resp.raise_for_status()
-    except httpx.RequestError as e:
-        logger.error(f"Ollama (prompt_without_context) - Request failed: {e}")
-        raise
-    response_text = resp.json()["choices"][0]["text"].strip()
+    response_text = await _post_extract_text(payload, "Ollama (prompt_without_context)")
     logger.info(f"Ollama (prompt_without_context) - Response: {response_text}")
 
     # Translate if necessary
     final_answer = await translate_if_needed(query, response_text)
 
+    if cache_key:
+        _llm_cache.set(cache_key, final_answer)
     return final_answer
 
-async def fast_reply(query: str, lang: str, available_modes: list, translated_mode_names: dict) -> str:
-    detected_user_lang = detect_language(query)
-    if detected_user_lang == 'en':
-        prompt_lang = 'en'
-    else:
-        prompt_lang = lang
+@functools.lru_cache(maxsize=256)
+def _fast_reply_system_prompt(prompt_lang: str, modes_key: tuple, mode_names_key: tuple) -> str:
+    """Renders the fast-reply system prompt once per (lang, modes) combo.
 
-    system_prompt = f"""Your name is Brainy. Your website is https://askbrainy.com. You are a helpful AI assistant built on free, open-source tools. Your creator's Telegram nickname is @bonbekon, and you will always be accessible for free. The core idea behind you is to combine a fast, open-source Large Language Model (QWEN 2.5 7B Instruct) with real-time context from the internet (a technique called RAG) to provide answers comparable in quality to proprietary models like ChatGPT 3.5 and sometimes even ChatGPT 4o. Your advantages vs other free AI tools: fast responses take less than 5 seconds on average, actual and unbiased information in other modes, you have a free unlimited deep research feauture.
+    Beyond skipping the f-string work, a byte-identical system prompt lets
+    the model server reuse its prompt prefix cache instead of
+    re-tokenizing ~400 static tokens per call.
+    """
+    translated_mode_names = dict(mode_names_key)
+    return f"""Your name is Brainy. Your website is https://askbrainy.com. You are a helpful AI assistant built on free, open-source tools. Your creator's Telegram nickname is @bonbekon, and you will always be accessible for free. The core idea behind you is to combine a fast, open-source Large Language Model (QWEN 2.5 7B Instruct) with real-time context from the internet (a technique called RAG) to provide answers comparable in quality to proprietary models like ChatGPT 3.5 and sometimes even ChatGPT 4o. Your advantages vs other free AI tools: fast responses take less than 5 seconds on average, actual and unbiased information in other modes, you have a free unlimited deep research feauture.
 
-Your goal is to give the shortest and most precise answer possible in the current 'Fast Answer' mode. Always answer in the "{prompt_lang}" language.
+Your goal is to give the shortest and most precise answer possible in the current 'Fast Answer' mode.
 
 If you cannot provide a short and precise answer, you MUST explicitly state that you cannot and advise the user to use other available modes. Here is a description of the modes to help you guide the user:
 - **{translated_mode_names['web_search']}:** Use this for questions that need up-to-date information. It provides actual, not outdated, information in about 20 seconds.
 - **{translated_mode_names['deep_search']}:** This mode provides actual and unbiased information by searching more thoroughly.
 - **{translated_mode_names['deep_research']}:** For complex questions, this mode reads hundreds of websites to produce the most relevant and comprehensive answer.
 
-Your available modes are: {', '.join(available_modes)}."""
+Your available modes are: {', '.join(modes_key)}.
+
+Always answer in the "{prompt_lang}" language."""
+
+async def fast_reply(query: str, lang: str, available_modes: list, translated_mode_names: dict) -> str:
+    prompt_lang = choose_prompt_lang(query, lang)
+
+    system_prompt = _fast_reply_system_prompt(
+        prompt_lang, tuple(available_modes), tuple(sorted(translated_mode_names.items()))
+    )
     user_prompt = f"{query}"
 
     payload = {
@@ -303,16 +434,22 @@ Your available modes are: {', '.join(available_modes)}."""
         "repetition_penalty": 1.1,
         "max_tokens": 400
     }
+    cache_key = LLMCache.key(payload)
+    if cache_key and (hit := _llm_cache.get(cache_key)) is not None:
+        logger.info("Ollama (fast-reply) - Cache hit.")
+        return hit
     logger.info(f"Ollama (fast-reply) - System Prompt: {system_prompt}")
     logger.info(f"Ollama (fast-reply) - User Prompt: {user_prompt}")
     try:
-        async with httpx.AsyncClient(timeout=config.OLLAMA_TIMEOUT) as client:
-            resp = await client.post(config.OLLAMA_CHAT_ENDPOINT, json=payload)
-            resp.raise_for_status()
+        resp = await _get_client().post(
+            config.OLLAMA_CHAT_ENDPOINT, content=orjson.dumps(payload),
+            headers=_JSON_HEADERS, timeout=TIMEOUT_FAST,
+        )
+        resp.raise_for_status()
     except httpx.RequestError as e:
         logger.error(f"Ollama (fast-reply) - Request failed: {e}")
         raise
-    response_json = resp.json()
+    response_json = orjson.loads(resp.content)
     if "message" in response_json:
         response_text = response_json["message"]["content"].strip()
     elif "choices" in response_json and len(response_json["choices"]) > 0:
@@ -327,78 +464,46 @@ Your available modes are: {', '.join(available_modes)}."""
         raise ValueError(f"Unexpected top-level response format from Ollama: {response_json}")
     logger.info(f"Ollama (fast-reply) - Response: {response_text}")
 
+    if cache_key:
+        _llm_cache.set(cache_key, response_text)
     return response_text
 
 async def generate_answer_from_serp(query: str, snippets: list, lang: str, translator, entities_info: list) -> str:
-    detected_user_lang = detect_language(query)
-    if detected_user_lang == 'en':
-        prompt_lang = 'en'
-    else:
-        prompt_lang = lang
+    prompt_lang = choose_prompt_lang(query, lang)
     # Log received snippets
     logger.info(f"Received snippets for LLM: {snippets}")
 
-    # Filter out duplicate snippets and store them for source selection
-    unique_snippets_for_ranking = _filter_duplicate_chunks(snippets)
-
-    # Sort snippets by text length to find the "top" sources
-    sorted_snippets = sorted(unique_snippets_for_ranking, key=lambda s: len(s.text), reverse=True)
-
-    # Get top 3 unique source URLs
-    top_sources = []
-    seen_urls = set()
-    for s in sorted_snippets:
-        if s.source_url not in seen_urls:
-            top_sources.append(s.source_url)
-            seen_urls.add(s.source_url)
-        if len(top_sources) >= 3:
-            break
-
-    snippets_by_domain = {}
-    for s in snippets:
-        if len(s.text) < 70:
-            continue
-        domain = urlparse(s.source_url).netloc
-        if domain not in snippets_by_domain:
-            snippets_by_domain[domain] = []
-        snippets_by_domain[domain].append(s.text)
-
-    snippet_texts = []
-    for domain, texts in snippets_by_domain.items():
-        combined_text = " ".join(texts)
-        snippet_texts.append(f"- {combined_text} [{domain}]")
-
-    snippet_text = "\n\n".join(snippet_texts)
+    snippet_text, top_sources = _prepare_snippet_context(snippets)
 
     # Prepare entity information for the prompt
     entity_context = ""
     if entities_info:
-        entity_context = "\n\nDiscovered Entities and their details:\n"
-        for entity in entities_info:
-            entity_context += f"- Entity: {entity['entity']}\n"
-            if entity['description']:
-                entity_context += f"  Description: {entity['description']}\n"
-            if entity['lead_paragraph']:
-                entity_context += f"  Lead Paragraph: {entity['lead_paragraph']}\n"
-            entity_context += f"  QID: {entity['qid']}\n"
-
-    prompt = f"""You are a skilled researcher. You are able to pick the most relevant data from a very broad context to answer the user's query in a short and precise way. Write a complete, coherent, and fact-rich answer to the user's query from context snippets and discovered entities. Keep only unique and valuable information (guidance, facts, numbers, addresses, characteristics) related to the user's query. The user's query: "{query}".\n{entity_context}\n\nRules: 1. Max output should be around 10-200 words. 2. Double check you don't repeat yourself and provide only unique and detailed information. 3. Answer in the "{prompt_lang}" language. 4. Stick closer to the language and style of provided context snippets. 5. Information discovered in "Discovered entities and their details" is the most reliable, and it is your final source of truth. 6. If the user query implies a short answer (facts, dates, quick advice etc), keep you answer very short. 7. If the user query implies a long answer (e.g. comparisons, lists, coding, analysis, research etc) provide a detailed answer.\nContext snippets: {snippet_text}"""
+        entity_context = _render_entity_context(_entity_context_key(entities_info))
+
+    prompt = (
+        _serp_prompt_prefix(prompt_lang)
+        + entity_context
+        + f'\n\nThe user\'s query: "{query}".'
+        + f"\nContext snippets: {snippet_text}"
+    )
     payload = {"model": "qwen2.5:3b-instruct",
                "prompt": prompt,
                "temperature": 0.2,
                "max_tokens": 550,
 }
 
-    logger.info(f"Ollama (generate_answer_from_serp) - Prompt: {prompt}")
-    try:
-        async with httpx.AsyncClient(timeout=OLLAMA_TIMEOUT) as client:
-            resp = await client.post(OLLAMA_ENDPOINT, json=payload)
-            resp.raise_for_status()
-    except httpx.RequestError as e:
-        logger.error(f"Ollama (generate_answer_from_serp) - Request failed: {e}")
-        raise
-    response_text = resp.json()["choices"][0]["text"].strip()
-    logger.info(f"Ollama (generate_answer_from_serp) - Response: {response_text}")
+    # Cache only the raw model output: the sources footer is derived from
+    # the snippets of this particular call
+    cache_key = LLMCache.key(payload)
+    response_text = _llm_cache.get(cache_key) if cache_key else None
+    if response_text is not None:
+        logger.info("Ollama (generate_answer_from_serp) - Cache hit.")
+    else:
+        logger.info(f"Ollama (generate_answer_from_serp) - Prompt: {prompt}")
+        response_text = await _post_extract_text(payload, "Ollama (generate_answer_from_serp)")
+        logger.info(f"Ollama (generate_answer_from_serp) - Response: {response_text}")
+        if cache_key:
+            _llm_cache.set(cache_key, response_text)
 
     final_answer = response_text
 
@@ -410,69 +515,27 @@ async def generate_answer_from_serp(query: str, snippets: list, lang: str, trans
     return final_answer
 
 async def generate_summary_from_chunks(query: str, snippets: list, lang: str, translator, entities_info: list) -> str:
-    detected_user_lang = detect_language(query)
-    if detected_user_lang == 'en':
-        prompt_lang = 'en'
-    else:
-        prompt_lang = lang
+    prompt_lang = choose_prompt_lang(query, lang)
     logger.info(f"Received snippets for LLM summary: {snippets}")
 
-    unique_snippets_for_ranking = _filter_duplicate_chunks(snippets)
-
-    sorted_snippets = sorted(unique_snippets_for_ranking, key=lambda s: len(s.text), reverse=True)
-
-    top_sources = []
-    seen_urls = set()
-    for s in sorted_snippets:
-        if s.source_url not in seen_urls:
-            top_sources.append(s.source_url)
-            seen_urls.add(s.source_url)
-        if len(top_sources) >= 3:
-            break
-
-    snippets_by_domain = {}
-    for s in snippets:
-        if len(s.text) < 70:
-            continue
-        domain = urlparse(s.source_url).netloc
-        if domain not in snippets_by_domain:
-            snippets_by_domain[domain] = []
-        snippets_by_domain[domain].append(s.text)
-
-    snippet_texts = []
-    for domain, texts in snippets_by_domain.items():
-        combined_text = " ".join(texts)
-        snippet_texts.append(f"- {combined_text} [{domain}]")
-
-    snippet_text = "\n\n".join(snippet_texts)
+    snippet_text, top_sources = _prepare_snippet_context(snippets)
 
     entity_context = ""
     if entities_info:
-        entity_context = "\n\nDiscovered Entities and their details:\n"
-        for entity in entities_info:
-            entity_context += f"- Entity: {entity['entity']}\n"
-            if entity['description']:
-                entity_context += f"  Description: {entity['description']}\n"
-            if entity['lead_paragraph']:
-                entity_context += f"  Lead Paragraph: {entity['lead_paragraph']}\n"
-            entity_context += f"  QID: {entity['qid']}\n"
-
-    prompt = f"""You are a skilled researcher. You are able to pick the most relevant data from a very broad context to answer the user's query in a detailed and precise way. Write a complete, coherent, and fact-rich answer to the user's query from context snippets and discovered entities. Keep only unique and valuable information (guidance, facts, numbers, addresses, characteristics) related to the user's query. The user's query: "{query}".\n{entity_context}\n\nRules: 1. Max output should be around 100-300 words. 2. Double check you don't repeat yourself and provide only unique and detailed information. 3. Answer in the "{prompt_lang}" language. 4. Do not add any information not present in the snippets. 4. Stick closer to the language and style of provided context snippets. 5. Information discovered in "Discovered entities and their details" is the most reliable, and it is your final source of truth.\nContext snippets: {snippet_text}"""
-    payload = {"model": "qwen2.5:3b-instruct", # Can be tweaked later
-               "prompt": prompt,
-               "temperature": 0.2,
-               "max_tokens": 800, # Adjusted for summary length
-}
-
+        entity_context = _render_entity_context(_entity_context_key(entities_info))
+
+    prompt = (
+        _summary_prompt_prefix(prompt_lang)
+        + entity_context
+        + f'\n\nThe user\'s query: "{query}".'
+        + f"\nContext snippets: {snippet_text}"
+    )
     logger.info(f"Ollama (generate_summary_from_chunks) - Prompt: {prompt}")
-    try:
-        async with httpx.AsyncClient(timeout=OLLAMA_TIMEOUT) as client:
-            resp = await client.post(OLLAMA_ENDPOINT, json=payload)
-            resp.raise_for_status()
-    except httpx.RequestError as e:
-        logger.error(f"Ollama (generate_summary_from_chunks) - Request failed: {e}")
-        raise
-    response_text = resp.json()["choices"][0]["text"].strip()
+    response_text = await _llm_complete(
+        prompt, model="qwen2.5:3b-instruct", # Can be tweaked later
+        params={"temperature": 0.2, "max_tokens": 800},  # Adjusted for summary length
+        log_prefix="Ollama (generate_summary_from_chunks)",
+    )
     logger.info(f"Ollama (generate_summary_from_chunks) - Response: {response_text}")
 
     #if top_sources:
@@ -482,11 +545,25 @@ async def generate_summary_from_chunks(query: str, snippets: list, lang: str, tr
 
     return response_text
 
+async def summarize_many(steps: list[tuple]) -> list[str]:
+    """Runs generate_summary_from_chunks for independent steps concurrently.
+
+    Each call is dominated by network wait on the pooled client, so
+    gathering them overlaps the LLM round-trips instead of paying them
+    back to back. Each tuple holds the positional args of
+    generate_summary_from_chunks.
+    """
+    return await asyncio.gather(*(generate_summary_from_chunks(*args) for args in steps))
+
+# One async Together client for the module lifetime (same pattern as
+# together_client): the per-call Together() constructor paid a fresh
+# TCP+TLS handshake, and its sync .create() blocked the event loop.
+_together_client = AsyncTogether(api_key=config.TOGETHER_AI_API_KEY)
+
 async def deepseek_r1_reply(query: str, lang: str) -> str:
-    client = Together(api_key=config.TOGETHER_AI_API_KEY)
     try:
         system_prompt = f"You are a helpful AI assistant. Always respond in the {lang} language."
-        response = client.chat.completions.create(
+        response = await _together_client.chat.completions.create(
             model=config.TOGETHER_DEEPSEEK,
             messages=[
                 {
@@ -1,8 +1,12 @@
 import asyncio
 import aiohttp
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
+import hashlib
 import logging
+import numpy as np
 import random
+from collections import OrderedDict, defaultdict
+from urllib.parse import urlparse
 import config
 
 logger = logging.getLogger(__name__)
@@ -26,6 +30,14 @@ class TextChunk:
         self.text = text
         self.source_url = source_url
         self.index = index
+        # Computed once at ingest: the prompt builders group snippets by
+        # domain and rank them by length on every LLM call
+        self.domain = urlparse(source_url).netloc
+        self.text_len = len(text)
+
+# Bodies are cut off here: beyond this, pages are boilerplate/comment tails
+# that the chunk ranker discards anyway, and reading them spikes memory
+MAX_PAGE_BYTES = 2_000_000
 
 async def fetch_page(session, url, retries=3):
     for attempt in range(retries):
@@ -36,13 +48,20 @@ async def fetch_page(session, url, retries=3):
         try:
             async with session.get(url, timeout=10, headers=headers, ssl=False) as response:
                 response.raise_for_status()
-                raw_body = await response.read()
+                # Stream the body instead of read()ing it whole, and stop at
+                # the cap so multi-MB pages can't balloon the fetch tasks
+                raw_body = bytearray()
+                async for part in response.content.iter_chunked(65536):
+                    raw_body += part
+                    if len(raw_body) >= MAX_PAGE_BYTES:
+                        logger.warning(f"Truncating {url} at {MAX_PAGE_BYTES} bytes.")
+                        break
                 try:
                     encoding = response.get_encoding()
-                    return raw_body.decode(encoding)
+                    return bytes(raw_body).decode(encoding)
                 except UnicodeDecodeError:
                     logger.warning(f"UnicodeDecodeError for {url}. Trying 'utf-8' with replacement characters.")
-                    return raw_body.decode('utf-8', errors='replace')
+                    return bytes(raw_body).decode('utf-8', errors='replace')
         except aiohttp.ClientResponseError as e:
             if e.status in [429, 503] and attempt < retries - 1:
                 delay = 2 ** attempt  # Exponential backoff
@@ -68,26 +87,31 @@ async def fetch_page(session, url, retries=3):
 def clean_html(html_content, url):
     logger.info(f"Cleaning HTML for URL: {url}")
     try:
-        soup = BeautifulSoup(html_content, 'html.parser')
-        for script_or_style in soup(["script", "style"]):
-            script_or_style.decompose()
-        
-        title = soup.title.string if soup.title and soup.title.string else ''
+        # Lexbor is a C HTML engine: parsing and text extraction run an
+        # order of magnitude faster than html.parser on real pages
+        tree = LexborHTMLParser(html_content)
+        for node in tree.css('script,style'):
+            node.decompose()
+
+        title_node = tree.css_first('title')
+        title = title_node.text() if title_node else ''
         if not title:
             logger.warning(f"No title found for {url}")
 
-        meta_description_tag = soup.find('meta', attrs={'name': 'description'})
-        meta_description = meta_description_tag['content'] if meta_description_tag and 'content' in meta_description_tag.attrs else ''
+        meta_tag = tree.css_first('meta[name="description"]')
+        meta_description = (meta_tag.attributes.get('content') or '') if meta_tag else ''
         if not meta_description:
             logger.warning(f"No meta description found for {url}")
 
-        paragraphs = soup.find_all('p')
-        list_items = soup.find_all('li')
-        tables = soup.find_all('table')
+        # One selector pass over the tree instead of three; buckets keep the
+        # same per-tag document order the separate scans produced
+        texts_by_tag = {'p': [], 'li': [], 'table': []}
+        for node in tree.css('p,li,table'):
+            texts_by_tag[node.tag].append(node.text())
 
-        p_text = ' '.join(p.get_text() for p in paragraphs) if paragraphs else ''
-        li_text = '\n'.join(li.get_text() for li in list_items) if list_items else ''
-        table_text = '\n'.join(table.get_text() for table in tables) if tables else ''
+        p_text = ' '.join(texts_by_tag['p'])
+        li_text = '\n'.join(texts_by_tag['li'])
+        table_text = '\n'.join(texts_by_tag['table'])
 
         combined_body_text = '\n\n'.join(filter(None, [p_text, li_text, table_text]))
 
@@ -107,57 +131,118 @@ try:
 except nltk.downloader.DownloadError:
     nltk.download('punkt')
 
+# nltk >= 3.8.2 re-instantiates the Punkt model inside every sent_tokenize
+# call; loading it once keeps tokenization off the hot path
+try:
+    from nltk.tokenize import PunktTokenizer
+    _PUNKT = PunktTokenizer('english')
+except ImportError:  # older nltk without the PunktTokenizer wrapper
+    _PUNKT = nltk.data.load('tokenizers/punkt/english.pickle')
+
 def chunk_text(text, source_url, max_chunk_words=150):
-    sentences = nltk.sent_tokenize(text)
+    sentences = _PUNKT.tokenize(text)
+    if not sentences:
+        return []
+
+    # Greedy packing over a cumulative word-count array: each chunk boundary
+    # is a searchsorted lookup instead of a per-sentence Python loop
+    word_counts = np.fromiter(
+        (len(s.split()) for s in sentences), dtype=np.int64, count=len(sentences)
+    )
+    cumulative = np.concatenate(([0], np.cumsum(word_counts)))
+
     chunks = []
-    current_chunk_sentences = []
-    current_chunk_word_count = 0
-
-    for sentence in sentences:
-        sentence_words = sentence.split()
-        if current_chunk_word_count + len(sentence_words) <= max_chunk_words:
-            current_chunk_sentences.append(sentence)
-            current_chunk_word_count += len(sentence_words)
-        else:
-            if current_chunk_sentences:
-                chunks.append(TextChunk(text=' '.join(current_chunk_sentences), source_url=source_url, index=len(chunks)))
-            current_chunk_sentences = [sentence]
-            current_chunk_word_count = len(sentence_words)
-    
-    if current_chunk_sentences:
-        chunks.append(TextChunk(text=' '.join(current_chunk_sentences), source_url=source_url, index=len(chunks)))
-    
+    lo = 0
+    while lo < len(sentences):
+        hi = int(np.searchsorted(cumulative, cumulative[lo] + max_chunk_words, side='right')) - 1
+        if hi <= lo:  # a single sentence over the limit still forms its own chunk
+            hi = lo + 1
+        chunks.append(TextChunk(text=' '.join(sentences[lo:hi]), source_url=source_url, index=len(chunks)))
+        lo = hi
+
     return chunks
 
-from urllib.parse import urlparse
+# Research runs re-fetch the same URLs across steps; keying the processed
+# chunks by content hash lets repeat pages skip parsing and tokenization
+# entirely (and a changed body invalidates naturally). LRU-bounded.
+_chunk_cache: OrderedDict = OrderedDict()
+_CHUNK_CACHE_MAX = 256
+
+def _clean_and_chunk(html, url):
+    key = (hashlib.blake2b(html.encode('utf-8', 'replace'), digest_size=16).digest(), url)
+    cached_texts = _chunk_cache.get(key)
+    if cached_texts is not None:
+        _chunk_cache.move_to_end(key)
+        # Re-materialize fresh TextChunks: cached entries hold only the
+        # immutable texts, so callers can't alias each other's objects
+        return [TextChunk(text=t, source_url=url, index=i) for i, t in enumerate(cached_texts)]
+
+    clean_text = clean_html(html, url)
+    if clean_text:
+        chunks = chunk_text(clean_text, source_url=url)
+    else:
+        logger.warning(f"Skipping chunking for {url} due to empty cleaned text.")
+        chunks = []
+    _chunk_cache[key] = tuple(c.text for c in chunks)
+    while len(_chunk_cache) > _CHUNK_CACHE_MAX:
+        _chunk_cache.popitem(last=False)
+    return chunks
+
+# Cap on simultaneous page fetches; keeps us polite without serializing the batch
+FETCH_CONCURRENCY = 10
+
+# One in-flight request per host: SERPs often return several URLs from the
+# same site, and hammering it in parallel invites 429s (and the retry
+# backoff they trigger). Unrelated hosts still proceed concurrently.
+_domain_semaphores: defaultdict[str, asyncio.Semaphore] = defaultdict(
+    lambda: asyncio.Semaphore(1)
+)
+
+# One session per process: a fresh ClientSession per batch threw away every
+# keep-alive connection and resolved DNS for the same hosts over and over.
+_session: aiohttp.ClientSession | None = None
+
+def _get_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=100,
+                limit_per_host=4,
+                ttl_dns_cache=300,
+                keepalive_timeout=30,
+            )
+        )
+    return _session
+
+async def close_session() -> None:
+    if _session is not None and not _session.closed:
+        await _session.close()
 
 async def fetch_and_process_pages(urls):
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        last_domain = None
-        # Use a set to keep track of unique URLs and avoid processing duplicates
-        unique_urls = list(dict.fromkeys(urls))
-        
-        for url in unique_urls:
-            domain = urlparse(url).netloc
-            if domain == last_domain:
-                logger.info(f"Waiting 2 seconds before fetching from same domain: {domain}")
-                await asyncio.sleep(2)
-            tasks.append(fetch_page(session, url))
-            last_domain = domain
-
-        html_contents = await asyncio.gather(*tasks)
-        
-        all_chunks = []
-        for i, html in enumerate(html_contents):
-            url = unique_urls[i] # Get the URL for logging
-            if html:
-                clean_text = await asyncio.to_thread(clean_html, html, url)
-                if clean_text: # Only chunk if there's actual cleaned text
-                    chunks = await asyncio.to_thread(chunk_text, clean_text, source_url=url)
-                    all_chunks.extend(chunks)
-                else:
-                    logger.warning(f"Skipping chunking for {url} due to empty cleaned text.")
-            else:
-                logger.warning(f"Skipping processing for {url} due to empty HTML content.")
-        return all_chunks
+    # Use a set to keep track of unique URLs and avoid processing duplicates
+    unique_urls = list(dict.fromkeys(urls))
+    semaphore = asyncio.Semaphore(FETCH_CONCURRENCY)
+    session = _get_session()
+
+    async def _fetch_and_chunk(url):
+        async with semaphore, _domain_semaphores[urlparse(url).netloc]:
+            html = await fetch_page(session, url)
+        if not html:
+            logger.warning(f"Skipping processing for {url} due to empty HTML content.")
+            return []
+        return await asyncio.to_thread(_clean_and_chunk, html, url)
+
+    # Each page is fetched and parsed in its own task, so parsing of early
+    # responses overlaps with fetching of slower ones.
+    results = await asyncio.gather(
+        *(_fetch_and_chunk(url) for url in unique_urls), return_exceptions=True
+    )
+
+    all_chunks = []
+    for url, result in zip(unique_urls, results):
+        if isinstance(result, BaseException):
+            logger.error(f"Error processing {url}: {result}")
+            continue
+        all_chunks.extend(result)
+    return all_chunks
@@ -9,11 +9,24 @@ class SearchClient:
     def __init__(self, search_backend='yandex', api_key=None):
         self.search_backend = search_backend
         self.api_key = api_key
+        # One client for the lifetime of the instance: keep-alive connections
+        # are reused across searches instead of a TLS handshake per call.
+        self._client: httpx.AsyncClient | None = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=20)
+            )
+        return self._client
+
+    async def aclose(self) -> None:
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
 
     async def search(self, query: str, num_results: int = 10) -> str:
         if self.search_backend == 'yandex':
-            async with httpx.AsyncClient() as client:
-                return await self._yandex_search(client, query, num_results)
+            return await self._yandex_search(self._get_client(), query, num_results)
         else:
             raise NotImplementedError(f"Search backend '{self.search_backend}' is not supported.")
 
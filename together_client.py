@@ -8,7 +8,7 @@ import asyncio
 import math
 import time
 import config
-from utils import detect_language, _filter_duplicate_chunks, strip_think
+from utils import detect_language, _filter_duplicate_chunks, strip_think, async_query_cache
 from httpx import ReadTimeout, ConnectTimeout, ConnectError, RemoteProtocolError
 
 
@@ -164,6 +164,71 @@ async def chat_with_fallback(*, model: str | None = None, messages: list, immedi
             logger.warning(f"[LLM] {primary} limited/unavailable; fallback -> {secondary}")
             return await _chat_once(model=secondary, messages=messages, **gen_kwargs)
         raise
+
+async def _chat_stream(*, model: str, messages: list, **kwargs):
+    """Streaming Together call that obeys per-second headers. Yields content deltas."""
+    await _wait_if_needed(model)
+    headers = {
+        "Authorization": f"Bearer {config.TOGETHER_AI_API_KEY}",
+        "Content-Type": "application/json",
+    }
+    payload = {"model": model, "messages": messages, "stream": True}
+    payload.update(kwargs)
+    timeout = kwargs.pop(
+        "timeout",
+        httpx.Timeout(connect=10.0, read=60.0, write=30.0, pool=60.0)
+    )
+    async with httpx.AsyncClient(timeout=timeout) as ac:
+        async with ac.stream("POST", API_URL, headers=headers, json=payload) as resp:
+            lr = {k:v for k,v in resp.headers.items() if k.lower().startswith(("x-rate","retry-after"))}
+            logger.info(f"[LLM] <- {model} {resp.status_code} (stream); rate_headers={lr}")
+            await _respect_headers(model, resp.headers, pace_after_success=(resp.status_code==200))
+            if resp.status_code in (429, 503):
+                await resp.aread()
+                if resp.status_code == 429:
+                    raise error.RateLimitError(resp.text[:500])
+                raise error.ServiceUnavailableError(resp.text[:500])
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                data = line[len("data: "):]
+                if data == "[DONE]":
+                    break
+                try:
+                    delta = json.loads(data)["choices"][0].get("delta", {}).get("content")
+                except (json.JSONDecodeError, KeyError, IndexError):
+                    continue
+                if delta:
+                    yield delta
+
+async def stream_with_fallback(*, model: str | None = None, messages: list, **gen_kwargs):
+    """Streaming twin of chat_with_fallback: on 429/503/timeout BEFORE the first
+    token, retry the OTHER free model; once deltas have flowed, errors propagate."""
+    primary = model or _choose_model_prefer_llama()
+    secondary = _other_free(primary)
+    yielded = False
+    try:
+        logger.info(f"[LLM] primary={primary} secondary={secondary} (stream)")
+        async for delta in _chat_stream(model=primary, messages=messages, **gen_kwargs):
+            yielded = True
+            yield delta
+        return
+    except (error.RateLimitError,
+            error.ServiceUnavailableError,
+            httpx.ReadTimeout,
+            httpx.ConnectTimeout,
+            httpx.ConnectError,
+            httpx.RemoteProtocolError):
+        if yielded:
+            raise
+        # помечаем первичную модель как «занятую» на пару секунд, чтобы планировщик не дёргал её тут же
+        now = asyncio.get_event_loop().time()
+        async with _model_lock:
+            _model_next_ok[primary] = max(_model_next_ok.get(primary, 0.0), now + 3.0)
+        logger.warning(f"[LLM] {primary} limited/unavailable (stream); fallback -> {secondary}")
+    async for delta in _chat_stream(model=secondary, messages=messages, **gen_kwargs):
+        yield delta
 # === End header-aware layer ===
 # Initialize the asynchronous client
 client = AsyncTogether(api_key=config.TOGETHER_AI_API_KEY)
@@ -225,6 +290,7 @@ def retry_on_server_error(retries=4, delay=2, backoff=2):
     return decorator
 
 
+@async_query_cache(maxsize=4096)
 @retry_on_server_error()
 async def get_sub_queries(query: str, lang: str) -> list[str]:
     detected_user_lang = detect_language(query)
@@ -673,8 +739,10 @@ IMPORTANT: You MUST respond with ONLY a valid JSON object (no markdown code bloc
 
     return final_answer_text
 
+_CJK_RE = re.compile(r'[\u3400-\u9fff\uf900-\ufaff]')
+
 def contains_chinese(text: str) -> bool:
-    return bool(re.search(r'[\u4e00-\u9fff]', text))
+    return _CJK_RE.search(text) is not None
 
 async def translate_if_needed(query: str, original_answer: str) -> str:
     if not contains_chinese(original_answer):
@@ -741,8 +809,7 @@ Question from the user: {query}
     return final_answer
 
 
-@retry_on_server_error()
-async def fast_reply(query: str, lang: str, available_modes: list, translated_mode_names: dict) -> str:
+def _fast_reply_payload(query: str, lang: str, translated_mode_names: dict) -> dict:
     detected_user_lang = detect_language(query)
     prompt_lang = 'en' if detected_user_lang == 'en' else lang
 
@@ -759,13 +826,11 @@ If you cannot provide a short and precise answer, you MUST explicitly state that
 
 Text formatting: MarkdownV2 format for Telegram. Please use emojis where relevant.
 """
-    user_prompt = f"{query}"
-
-    payload = {
+    return {
         "model": config.TOGETHER_MODEL,
         "messages": [
             {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
+            {"role": "user", "content": f"{query}"}
         ],
         "temperature": 0.3,
         "top_k": 50,
@@ -774,8 +839,13 @@ Text formatting: MarkdownV2 format for Telegram. Please use emojis where relevan
         "max_tokens": 5000,
         "reasoning_effort": "low",
     }
-    logger.info(f"Together AI (fast-reply) - System Prompt: {system_prompt}")
-    logger.info(f"Together AI (fast-reply) - User Prompt: {user_prompt}")
+
+
+@retry_on_server_error()
+async def fast_reply(query: str, lang: str, available_modes: list, translated_mode_names: dict) -> str:
+    payload = _fast_reply_payload(query, lang, translated_mode_names)
+    logger.info(f"Together AI (fast-reply) - System Prompt: {payload['messages'][0]['content']}")
+    logger.info(f"Together AI (fast-reply) - User Prompt: {payload['messages'][1]['content']}")
     try:
         response = data = await chat_with_fallback(**payload)
         response_text = strip_think(data['choices'][0]['message']['content']).strip()
@@ -787,6 +857,15 @@ Text formatting: MarkdownV2 format for Telegram. Please use emojis where relevan
     return response_text
 
 
+async def fast_reply_stream(query: str, lang: str, available_modes: list, translated_mode_names: dict):
+    """Streaming variant of fast_reply: yields raw content deltas (including any
+    <think> prefix — the caller strips it) so the UI can render progressively."""
+    payload = _fast_reply_payload(query, lang, translated_mode_names)
+    logger.info(f"Together AI (fast-reply-stream) - User Prompt: {payload['messages'][1]['content']}")
+    async for delta in stream_with_fallback(**payload):
+        yield delta
+
+
 @retry_on_server_error()
 async def generate_answer_from_serp(query: str, snippets: list, lang: str, translator, entities_info: list) -> str:
     detected_user_lang = detect_language(query)
@@ -1,5 +1,9 @@
-import py3langid
+import hashlib
 import re
+from collections import OrderedDict
+from functools import lru_cache, wraps
+
+import py3langid
 
 # Hardcoded translations for specific strings
 TRANSLATIONS = {
@@ -97,22 +101,71 @@ def strip_think(text: str) -> str:
     return text.strip()
 
 
+@lru_cache(maxsize=4096)
 def detect_language(text: str) -> str:
-    """Detects the language of the given text using py3langid."""
+    """Detects the language of the given text using py3langid.
+
+    Cached: the same query passes through every pipeline stage (sub-queries,
+    research steps, synthesis), and each one re-detects its language."""
     lang, _ = py3langid.classify(text)
     return lang
 
+def choose_prompt_lang(query: str, lang: str, detected: str | None = None) -> str:
+    """Picks the prompt language: English queries get English prompts,
+    everything else uses the user's interface language. Callers that have
+    already detected the query language pass it in to skip detection."""
+    if detected is None:
+        detected = detect_language(query)
+    return 'en' if detected == 'en' else lang
+
+_WS_RUN = re.compile(r"\s+")
+
+def async_query_cache(maxsize: int = 1024):
+    """LRU cache for async functions whose first two args are (text, lang).
+
+    Keys on the lowercased, whitespace-collapsed text, so queries that repeat
+    verbatim or near-verbatim across steps and users skip the upstream call.
+    Cached results are returned as-is and must be treated as read-only.
+    """
+    def decorator(func):
+        cache: OrderedDict = OrderedDict()
+
+        @wraps(func)
+        async def wrapper(query: str, lang: str, *args, **kwargs):
+            key = (_WS_RUN.sub(" ", query.lower()).strip(), lang)
+            if key in cache:
+                cache.move_to_end(key)
+                return cache[key]
+            result = await func(query, lang, *args, **kwargs)
+            cache[key] = result
+            if len(cache) > maxsize:
+                cache.popitem(last=False)
+            return result
+        return wrapper
+    return decorator
+
+def _chunk_key(text):
+    """64-bit digest of case/whitespace-normalized text for duplicate detection."""
+    if not isinstance(text, str):
+        return text
+    norm = _WS_RUN.sub(" ", text.lower()).strip()
+    return hashlib.blake2b(norm.encode('utf-8'), digest_size=8).digest()
+
 def _filter_duplicate_chunks(chunks: list) -> list:
-    """Filters out duplicate chunks based on their text content."""
-    seen_texts = set()
+    """Filters out duplicate chunks based on their normalized text content."""
+    seen_keys = set()
     unique_chunks = []
     for chunk in chunks:
         # This check assumes chunk has a .text attribute.
         # It might need to be adapted if chunks are of different types.
-        if hasattr(chunk, 'text') and chunk.text not in seen_texts:
-            seen_texts.add(chunk.text)
-            unique_chunks.append(chunk)
-        elif isinstance(chunk, dict) and chunk.get('text') not in seen_texts:
-            seen_texts.add(chunk['text'])
+        if hasattr(chunk, 'text'):
+            text = chunk.text
+        elif isinstance(chunk, dict):
+            text = chunk.get('text')
+        else:
+            continue
+        key = _chunk_key(text)
+        if key not in seen_keys:
+            seen_keys.add(key)
             unique_chunks.append(chunk)
     return unique_chunks
\ No newline at end of file
@@ -6,8 +6,12 @@ import config
 logger = logging.getLogger(__name__)
 
 WIKIDATA_SPARQL_ENDPOINT = "https://query.wikidata.org/sparql"
+WIKIDATA_API_ENDPOINT = "https://www.wikidata.org/w/api.php"
 WIKIPEDIA_REST_API_BASE = "https://{lang}.wikipedia.org/api/rest_v1/page/summary/{title}"
 
+# wbgetentities accepts at most 50 ids per request
+_WBGETENTITIES_BATCH = 50
+
 async def _execute_sparql_query(client: httpx.AsyncClient, query: str) -> dict | None:
     """Helper function to execute SPARQL queries against Wikidata asynchronously."""
     headers = {
@@ -43,6 +47,49 @@ async def get_wikidata_description(client: httpx.AsyncClient, qid: str, lang: st
     logger.warning(f"No Wikidata description found for {qid} in language {lang}")
     return None
 
+async def get_wikidata_descriptions(client: httpx.AsyncClient, qids: list[str], lang: str) -> dict[str, str | None]:
+    """Fetches descriptions for several Q-IDs in one batched wbgetentities call.
+
+    Prefers the requested language and falls back to English. Returns a
+    mapping of Q-ID -> description (or None when neither language has one).
+    """
+    descriptions: dict[str, str | None] = {qid: None for qid in qids}
+    if not qids:
+        return descriptions
+
+    headers = {'User-Agent': config.CUSTOM_USER_AGENT}
+    languages = lang if lang == 'en' else f"{lang}|en"
+
+    for start in range(0, len(qids), _WBGETENTITIES_BATCH):
+        batch = qids[start:start + _WBGETENTITIES_BATCH]
+        params = {
+            'action': 'wbgetentities',
+            'ids': '|'.join(batch),
+            'props': 'descriptions',
+            'languages': languages,
+            'format': 'json',
+        }
+        try:
+            response = await client.get(WIKIDATA_API_ENDPOINT, headers=headers, params=params)
+            response.raise_for_status()
+            entities = response.json().get('entities', {})
+        except httpx.RequestError as e:
+            logger.error(f"Error fetching batched descriptions for {batch}: {e}")
+            continue
+        except json.JSONDecodeError:
+            logger.error(f"Failed to decode JSON from wbgetentities for {batch}. Response: {response.text}")
+            continue
+
+        for qid in batch:
+            entity_descriptions = entities.get(qid, {}).get('descriptions', {})
+            value = (entity_descriptions.get(lang) or entity_descriptions.get('en') or {}).get('value')
+            if value:
+                logger.info(f"Fetched Wikidata description for {qid} ({lang}): {value[:50]}...")
+                descriptions[qid] = value
+            else:
+                logger.warning(f"No Wikidata description found for {qid} in language {lang}")
+    return descriptions
+
 async def get_wikipedia_lead_paragraph(client: httpx.AsyncClient, qid: str, lang: str) -> str | None:
     """Fetches the lead paragraph for a given Q-ID from Wikipedia, with English fallback."""
     async def fetch_title(target_lang: str):